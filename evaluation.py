@@ -1,16 +1,32 @@
 import os
+import csv
 import json
 import re
+import argparse
+from itertools import combinations
+import numpy as np
 from collections import Counter
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 
 RESULTS_DIR = "results"
+# metrics per results file, reused while the file's mtime and size are unchanged
+METRICS_CACHE = ".cache/evaluation_metrics.json"
 
+ARTICLES = re.compile(r'\b(a|an|the)\b')
+PUNCTUATION = re.compile(r'[^a-z0-9\s]')
+WHITESPACE = re.compile(r'\s+')
+
+METRICS = ("acc", "em", "f1")
+COMPARISON_TABLE = "results/comparison.csv"
+
+@lru_cache(maxsize=65536)
 def normalize_text(s: str) -> str:
     """Lowercase and remove punctuation/articles/extra spaces for EM/F1."""
     s = s.lower()
-    s = re.sub(r'\b(a|an|the)\b', ' ', s)  # remove articles
-    s = re.sub(r'[^a-z0-9\s]', ' ', s)     # remove punctuation
-    s = re.sub(r'\s+', ' ', s).strip()
+    s = ARTICLES.sub(' ', s)  # remove articles
+    s = PUNCTUATION.sub(' ', s)     # remove punctuation
+    s = WHITESPACE.sub(' ', s).strip()
     return s
 
 def f1_score(pred: str, gold: str) -> float:
@@ -28,64 +44,296 @@ def f1_score(pred: str, gold: str) -> float:
     recall = num_same / len(gold_tokens)
     return 2 * precision * recall / (precision + recall)
 
-def evaluate_file(path: str):
+def iter_results(path: str, chunk_size=1 << 20):
+    """
+    yield (instance_id, result) pairs of a results file one at a time,
+    reading the top-level JSON object in chunks instead of loading it whole
+    """
+    decoder = json.JSONDecoder()
     with open(path) as f:
-        results = json.load(f)
+        buffer = ""
+        pos = 0
+        eof = False
 
-    total = 0
-    acc = 0
-    em = 0
-    f1 = 0.0
+        def skip(chars):
+            # advance past whitespace and the given separators, reading more input if needed
+            nonlocal buffer, pos, eof
+            while True:
+                while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] in chars):
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return
+                buffer, pos = f.read(chunk_size), 0
+                eof = not buffer
 
-    for instance_id, res in results.items():
-        if "error" in res or "answer_choice" not in res:
-            continue  # skip failed or invalid cases
-        total += 1
+        def decode():
+            nonlocal buffer, pos, eof
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    # a number at the end of the buffer may continue in the next chunk
+                    if end < len(buffer) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+
+        skip("{")
+        while True:
+            skip(",")
+            if pos >= len(buffer) or buffer[pos] == "}":
+                return
+            instance_id = decode()
+            skip(":")
+            yield instance_id, decode()
+
+def dataset_of(instance_id: str) -> str:
+    if instance_id.startswith("/wiki/"):
+        return "TimeQA"
+    if instance_id.startswith("story"):
+        return "TGQA"
+    return "Unknown"
+
+def summarize(total, acc, em, f1):
+    return {"total": total, "acc": acc / total, "em": em / total, "f1": f1 / total}
+
+def instance_scores(res):
+    """(acc, em, f1) of one result record, or None for failed or invalid cases"""
+    if "error" in res or "answer_choice" not in res:
+        return None
+
+    pred = res["answer_choice"]
+    gold_answers = res["gold_answer"]
 
-        pred = res["answer_choice"]
-        gold_answers = res["gold_answer"]
+    # Accuracy: exact candidate match (no normalization)
+    acc_this = int(pred in gold_answers)
 
-        # Accuracy: exact candidate match (no normalization)
-        if pred in gold_answers:
-            acc += 1
+    # EM / F1: normalized
+    em_this = 0
+    f1_this = 0
+    for gold in gold_answers:
+        if normalize_text(pred) == normalize_text(gold):
+            em_this = 1
+        f1_this = max(f1_this, f1_score(pred, gold))
+    return acc_this, em_this, f1_this
 
-        # EM / F1: normalized
-        em_this = 0
-        f1_this = 0
-        for gold in gold_answers:
-            if normalize_text(pred) == normalize_text(gold):
-                em_this = 1
-            f1_this = max(f1_this, f1_score(pred, gold))
+def evaluate_file(path: str):
+    # running sums (total, acc, em, f1) overall, per Q-Type and per dataset
+    sums = {}
+
+    for instance_id, res in iter_results(path):
+        scores = instance_scores(res)
+        if scores is None:
+            continue  # skip failed or invalid cases
+        acc_this, em_this, f1_this = scores
 
-        em += em_this
-        f1 += f1_this
+        qtype = res.get("instance_qtype") or "Unknown"
+        for key in ["all", ("qtype", qtype), ("dataset", dataset_of(instance_id))]:
+            total, acc, em, f1 = sums.get(key, (0, 0, 0, 0.0))
+            sums[key] = (total + 1, acc + acc_this, em + em_this, f1 + f1_this)
 
-    if total == 0:
+    if "all" not in sums:
         return None
 
     return {
         "file": os.path.basename(path),
-        "total": total,
-        "acc": acc / total,
-        "em": em / total,
-        "f1": f1 / total,
+        **summarize(*sums["all"]),
+        "by_qtype": {key[1]: summarize(*v) for key, v in sorted(sums.items(), key=str) if key[0] == "qtype"},
+        "by_dataset": {key[1]: summarize(*v) for key, v in sorted(sums.items(), key=str) if key[0] == "dataset"},
     }
 
-def evaluate_all(results_dir=RESULTS_DIR):
-    files = [f for f in os.listdir(results_dir) if f.endswith(".json") and f != "asp_results.json"]
+def load_metrics_cache(cache_path=METRICS_CACHE):
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path) as f:
+        return json.load(f)
+
+def save_metrics_cache(cache, cache_path=METRICS_CACHE):
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, cache_path)
+
+def evaluate_all(results_dir=RESULTS_DIR, workers=None, cache_path=METRICS_CACHE, verbose=True):
+    """
+    evaluate every results file, re-evaluating only files that are new or changed since the cached run
+    (files are compared by mtime and size); changed files are evaluated in parallel
+    """
+    files = sorted(f for f in os.listdir(results_dir) if f.endswith(".json") and f != "asp_results.json")
+
+    cache = load_metrics_cache(cache_path)
+    stats = {}
+    changed = []
+    for fname in files:
+        path = os.path.abspath(os.path.join(results_dir, fname))
+        st = os.stat(path)
+        stats[path] = [st.st_mtime_ns, st.st_size]
+        entry = cache.get(path)
+        if entry is None or [entry["mtime_ns"], entry["size"]] != stats[path]:
+            changed.append(path)
+
+    if changed:
+        if len(changed) > 1 and workers != 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                evaluated = list(pool.map(evaluate_file, changed))
+        else:
+            evaluated = [evaluate_file(path) for path in changed]
+        for path, res in zip(changed, evaluated):
+            cache[path] = {"mtime_ns": stats[path][0], "size": stats[path][1], "metrics": res}
+        # forget files that no longer exist
+        cache = {path: entry for path, entry in cache.items() if os.path.exists(path)}
+        save_metrics_cache(cache, cache_path)
 
     all_results = []
     for fname in files:
-        res = evaluate_file(os.path.join(results_dir, fname))
+        res = cache[os.path.abspath(os.path.join(results_dir, fname))]["metrics"]
         if res:
             all_results.append(res)
 
-    for r in all_results:
-        print(f"\nFile: {r['file']}")
-        print(f"  Evaluated {r['total']} instances")
-        print(f"  Accuracy: {r['acc']*100:.5f}%")
-        print(f"  Exact Match (EM): {r['em']*100:.5f}%")
-        print(f"  F1: {r['f1']*100:.5f}%")
+    if verbose:
+        for r in all_results:
+            print(f"\nFile: {r['file']}")
+            print(f"  Evaluated {r['total']} instances")
+            print(f"  Accuracy: {r['acc']*100:.5f}%")
+            print(f"  Exact Match (EM): {r['em']*100:.5f}%")
+            print(f"  F1: {r['f1']*100:.5f}%")
+            for group in ["by_dataset", "by_qtype"]:
+                for name, g in r[group].items():
+                    print(f"    {name}: {g['total']} instances, acc {g['acc']*100:.2f}%, "
+                          f"EM {g['em']*100:.2f}%, F1 {g['f1']*100:.2f}%")
+
+    return all_results
+
+def score_vectors(path: str) -> dict:
+    """instance_id -> (acc, em, f1) for every scored instance of a results file"""
+    scores = {}
+    for instance_id, res in iter_results(path):
+        scored = instance_scores(res)
+        if scored is not None:
+            scores[instance_id] = scored
+    return scores
+
+def align_scores(*score_dicts):
+    """
+    per-instance score matrices restricted to the instances scored in every run
+
+    Return:
+        (instance_ids, [array of shape (n_instances, 3) per run]) with columns acc, em, f1
+    """
+    shared = set(score_dicts[0])
+    for scores in score_dicts[1:]:
+        shared &= set(scores)
+    instance_ids = sorted(shared)
+    return instance_ids, [np.array([scores[i] for i in instance_ids], dtype=float).reshape(-1, len(METRICS))
+                          for scores in score_dicts]
+
+def resample_weights(n, n_resamples, rng):
+    """bootstrap resamples of n instances as a (n_resamples, n) matrix of draw counts"""
+    draws = rng.integers(0, n, size=(n_resamples, n))
+    # count the draws of every resample at once: offset each row into its own block of n bins
+    offsets = np.arange(n_resamples)[:, None] * n
+    return np.bincount((draws + offsets).ravel(), minlength=n_resamples * n).reshape(n_resamples, n)
+
+def bootstrap_ci(scores, n_resamples=10000, alpha=0.05, seed=0):
+    """
+    percentile bootstrap confidence intervals of the column means of scores (n_instances, k),
+    all resamples computed as one matrix product
+
+    Return:
+        (low, high) arrays of length k
+    """
+    rng = np.random.default_rng(seed)
+    means = resample_weights(len(scores), n_resamples, rng) @ scores / len(scores)
+    return np.quantile(means, alpha / 2, axis=0), np.quantile(means, 1 - alpha / 2, axis=0)
+
+def paired_tests(scores_a, scores_b, n_resamples=10000, alpha=0.05, seed=0):
+    """
+    paired bootstrap and sign-flip permutation tests of mean(a) - mean(b), per column
+
+    Return:
+        dict of arrays of length k: diff, ci_low, ci_high, p_bootstrap, p_permutation (two-sided)
+    """
+    diffs = scores_a - scores_b
+    n = len(diffs)
+    observed = diffs.mean(axis=0)
+    rng = np.random.default_rng(seed)
+
+    # bootstrap distribution of the mean difference; the p-value is how often it crosses zero
+    boot = resample_weights(n, n_resamples, rng) @ diffs / n
+    p_bootstrap = np.minimum(1.0, 2 * np.minimum((boot <= 0).mean(axis=0), (boot >= 0).mean(axis=0)))
+
+    # under the null each paired difference is equally likely to have either sign
+    signs = rng.choice(np.array([-1.0, 1.0]), size=(n_resamples, n))
+    permuted = signs @ diffs / n
+    exceed = (np.abs(permuted) >= np.abs(observed) - 1e-12).sum(axis=0)
+    p_permutation = (exceed + 1) / (n_resamples + 1)
+
+    return {
+        "diff": observed,
+        "ci_low": np.quantile(boot, alpha / 2, axis=0),
+        "ci_high": np.quantile(boot, 1 - alpha / 2, axis=0),
+        "p_bootstrap": p_bootstrap,
+        "p_permutation": p_permutation,
+    }
+
+def compare_runs(results_dir=RESULTS_DIR, out_path=COMPARISON_TABLE, n_resamples=10000, alpha=0.05, seed=0):
+    """
+    confidence intervals for every results file and paired tests for every pair of files
+    that share instances, written to a CSV table with one row per (file, file, metric)
+
+    rows with file_b empty hold a single run's mean and CI; the other rows compare file_a against file_b
+    on the instances both scored
+    """
+    files = sorted(f for f in os.listdir(results_dir) if f.endswith(".json") and f != "asp_results.json")
+    vectors = {fname: score_vectors(os.path.join(results_dir, fname)) for fname in files}
+    vectors = {fname: scores for fname, scores in vectors.items() if scores}
+
+    rows = []
+    for fname, scores in vectors.items():
+        _, (matrix,) = align_scores(scores)
+        low, high = bootstrap_ci(matrix, n_resamples, alpha, seed)
+        for k, metric in enumerate(METRICS):
+            rows.append({"file_a": fname, "file_b": "", "metric": metric, "n": len(matrix),
+                         "mean_a": matrix[:, k].mean(), "mean_b": "", "diff": "",
+                         "ci_low": low[k], "ci_high": high[k], "p_bootstrap": "", "p_permutation": ""})
+
+    for file_a, file_b in combinations(vectors, 2):
+        instance_ids, (matrix_a, matrix_b) = align_scores(vectors[file_a], vectors[file_b])
+        if not instance_ids:
+            continue  # different datasets
+        tests = paired_tests(matrix_a, matrix_b, n_resamples, alpha, seed)
+        for k, metric in enumerate(METRICS):
+            rows.append({"file_a": file_a, "file_b": file_b, "metric": metric, "n": len(instance_ids),
+                         "mean_a": matrix_a[:, k].mean(), "mean_b": matrix_b[:, k].mean(),
+                         **{key: values[k] for key, values in tests.items()}})
+
+    for row in rows:
+        for key, value in row.items():
+            if isinstance(value, np.floating):
+                row[key] = round(float(value), 6)
+
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["file_a", "file_b", "metric", "n", "mean_a", "mean_b", "diff",
+                                               "ci_low", "ci_high", "p_bootstrap", "p_permutation"])
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Wrote {len(rows)} rows to {out_path}")
+    return rows
 
 if __name__ == "__main__":
-    evaluate_all()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--compare", action="store_true",
+                        help="write bootstrap CIs and paired significance tests to " + COMPARISON_TABLE)
+    parser.add_argument("--resamples", type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_runs(n_resamples=args.resamples)
+    else:
+        evaluate_all()
@@ -0,0 +1,288 @@
+# columnar storage of ASP results: interned terms and events, int32 columns per predicate
+# one .npz file holds the answer sets of all stories; atoms are rendered back to clingo's text form on demand
+
+import os
+import re
+import json
+import numpy as np
+from asp_store import iter_results
+
+ANSWER_SETS_PATH = "results/asp_results.npz"
+FORMAT_VERSION = 1
+
+# columns per predicate of tg_reasoner.lp; "event" and "other" hold event ids, all other columns integers
+COLUMNS = {
+    "event": ("event", "start_year", "start_month", "end_year", "end_month"),
+    "start": ("event", "time"),
+    "end": ("event", "time"),
+    "ordering_on_start_years": ("event", "rank"),
+    "length": ("event", "years", "months"),
+    "longer_than": ("event", "other"),
+    "time_passed": ("event", "other", "years", "months"),
+    "starts_at": ("event", "year"),
+    "started_same_year": ("event", "other"),
+    "was_still_happening": ("event", "other"),
+}
+EVENT_COLUMNS = ("event", "other")
+
+# predicates whose event arguments are spelled out as S,R,O instead of an event(S,R,O) term
+FLAT_EVENT_PREDICATES = ("event", "start", "end")
+
+# status of a story's result
+OK, UNSAT, TIMEOUT, ERROR = range(4)
+MARKERS = {UNSAT: "UNSAT", TIMEOUT: "TIMEOUT", ERROR: "ERROR"}
+
+TOKEN = re.compile(r"[^(),]+")
+
+
+def parse_atom(atom: str):
+    """
+    split an atom of a predicate in COLUMNS into (predicate, [(S, R, O) or int per column])
+    """
+    pred, _, args = atom.partition("(")
+    tokens = TOKEN.findall(args)
+    values = []
+    pos = 0
+    for column in COLUMNS[pred]:
+        if column in EVENT_COLUMNS:
+            if pred not in FLAT_EVENT_PREDICATES:
+                pos += 1  # skip the "event" functor
+            values.append(tuple(tokens[pos:pos + 3]))
+            pos += 3
+        else:
+            values.append(int(tokens[pos]))
+            pos += 1
+    return pred, values
+
+
+def _pack_strings(strings):
+    """strings as one UTF-8 buffer plus offsets (no pickled object arrays in the .npz)"""
+    encoded = [s.encode() for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(buffer, offsets):
+    data = buffer.tobytes()
+    return [data[offsets[i]:offsets[i + 1]].decode() for i in range(len(offsets) - 1)]
+
+
+def build_answer_sets(results_path, out_path=ANSWER_SETS_PATH):
+    """
+    convert ASP results (JSONL stream or asp_results.json, see asp_store.iter_results) to the columnar format
+
+    Return:
+        The number of stories converted
+    """
+    terms, term_ids = [], {}
+    events, event_ids = [], {}
+
+    def term_id(term):
+        if term not in term_ids:
+            term_ids[term] = len(terms)
+            terms.append(term)
+        return term_ids[term]
+
+    def event_id(sro):
+        if sro not in event_ids:
+            event_ids[sro] = len(events)
+            events.append([term_id(t) for t in sro])
+        return event_ids[sro]
+
+    stories, status, errors = [], [], {}
+    columns = {pred: {column: [] for column in cols} for pred, cols in COLUMNS.items()}
+    offsets = {pred: [0] for pred in COLUMNS}
+
+    for story, result in iter_results(results_path):
+        stories.append(story)
+        if "UNSAT" in result:
+            status.append(UNSAT)
+        elif "TIMEOUT" in result:
+            status.append(TIMEOUT)
+        elif "ERROR" in result:
+            status.append(ERROR)
+            errors[story] = result["ERROR"]
+        else:
+            status.append(OK)
+            unknown = set(result) - set(COLUMNS)
+            if unknown:
+                raise ValueError(f"{story}: no columnar layout for predicates {sorted(unknown)}")
+            for pred, atoms in result.items():
+                pred_columns = [columns[pred][column] for column in COLUMNS[pred]]
+                for atom in atoms:
+                    _, values = parse_atom(atom)
+                    for column, column_name, value in zip(pred_columns, COLUMNS[pred], values):
+                        column.append(event_id(value) if column_name in EVENT_COLUMNS else value)
+        for pred in COLUMNS:
+            offsets[pred].append(len(columns[pred]["event"]))
+
+    arrays = {}
+    arrays["terms"], arrays["term_offsets"] = _pack_strings(terms)
+    arrays["stories"], arrays["story_offsets"] = _pack_strings(stories)
+    arrays["status"] = np.array(status, dtype=np.int8)
+    arrays["events"] = np.array(events, dtype=np.int32).reshape(-1, 3)
+    arrays["meta"] = np.frombuffer(json.dumps({"version": FORMAT_VERSION, "errors": errors}).encode(), dtype=np.uint8)
+    for pred, cols in columns.items():
+        arrays[f"{pred}/offsets"] = np.array(offsets[pred], dtype=np.int64)
+        for column, values in cols.items():
+            arrays[f"{pred}/{column}"] = np.array(values, dtype=np.int32)
+
+    tmp_path = out_path + ".tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, out_path)
+    return len(stories)
+
+
+class AnswerSets:
+    """
+    read access to a file written by build_answer_sets
+
+    get/story/__contains__ mirror asp_store.AspResultsStore, so either can back the LLM pipeline;
+    facts, by_event, by_subject and by_year_range return column arrays instead of atom strings.
+    the file is loaded on first use
+    """
+
+    def __init__(self, path=ANSWER_SETS_PATH):
+        self.path = path
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"{self.path} not found, build it with answer_sets.build_answer_sets")
+        with np.load(self.path) as data:
+            arrays = {key: data[key] for key in data.files}
+        meta = json.loads(arrays["meta"].tobytes())
+        if meta["version"] != FORMAT_VERSION:
+            raise ValueError(f"{self.path} has format version {meta['version']}, expected {FORMAT_VERSION}")
+
+        self.terms = _unpack_strings(arrays["terms"], arrays["term_offsets"])
+        self.stories = _unpack_strings(arrays["stories"], arrays["story_offsets"])
+        self.story_index = {story: i for i, story in enumerate(self.stories)}
+        self.status = arrays["status"]
+        self.errors = meta["errors"]
+        self.events = arrays["events"]
+        self.columns = {pred: {column: arrays[f"{pred}/{column}"] for column in cols}
+                        for pred, cols in COLUMNS.items()}
+        self.offsets = {pred: arrays[f"{pred}/offsets"] for pred in COLUMNS}
+        self._term_ids = None
+        self._event_terms = {}
+        self._loaded = True
+
+    # -----------------------------
+    # Columnar queries
+    # -----------------------------
+
+    def facts(self, story, predicate) -> dict:
+        """column arrays (views) of one predicate's atoms for a story; empty arrays for unknown stories"""
+        self._load()
+        i = self.story_index.get(story)
+        if i is None:
+            return {column: values[:0] for column, values in self.columns[predicate].items()}
+        start, end = self.offsets[predicate][i], self.offsets[predicate][i + 1]
+        return {column: values[start:end] for column, values in self.columns[predicate].items()}
+
+    def term_id(self, term):
+        """id of an interned term, or -1 if it does not occur"""
+        self._load()
+        if self._term_ids is None:
+            self._term_ids = {term: i for i, term in enumerate(self.terms)}
+        return self._term_ids.get(term, -1)
+
+    def _select(self, facts, mask):
+        return {column: values[mask] for column, values in facts.items()}
+
+    def by_event(self, story, predicate, event):
+        """atoms of predicate involving the event (S, R, O) as either event argument"""
+        facts = self.facts(story, predicate)
+        s, r, o = (self.term_id(term) for term in event)
+        mask = np.zeros(len(facts["event"]), dtype=bool)
+        for column in EVENT_COLUMNS:
+            if column in facts:
+                ids = self.events[facts[column]]
+                mask |= (ids[:, 0] == s) & (ids[:, 1] == r) & (ids[:, 2] == o)
+        return self._select(facts, mask)
+
+    def by_subject(self, story, predicate, subject):
+        """atoms of predicate whose (first) event has the given subject"""
+        facts = self.facts(story, predicate)
+        mask = self.events[facts["event"], 0] == self.term_id(subject)
+        return self._select(facts, mask)
+
+    def by_year_range(self, story, predicate, first_year, last_year):
+        """atoms of predicate whose (first) event starts between first_year and last_year (inclusive)"""
+        facts = self.facts(story, predicate)
+        starts = self.facts(story, "starts_at")
+        in_range = starts["event"][(starts["year"] >= first_year) & (starts["year"] <= last_year)]
+        return self._select(facts, np.isin(facts["event"], in_range))
+
+    # -----------------------------
+    # ASP text
+    # -----------------------------
+
+    def _event_texts(self, event_ids, flat):
+        """"S,R,O" (flat) or "event(S,R,O)" per event id, memoized per event"""
+        cache = self._event_terms.setdefault(flat, {})
+        texts = []
+        for event_id in event_ids:
+            text = cache.get(event_id)
+            if text is None:
+                text = ",".join(self.terms[t] for t in self.events[event_id])
+                if not flat:
+                    text = f"event({text})"
+                cache[event_id] = text
+            texts.append(text)
+        return texts
+
+    def render(self, predicate, facts) -> list:
+        """atoms as clingo prints them, e.g. time_passed(event(a,b,c),event(d,e,f),3,4)"""
+        self._load()
+        flat = predicate in FLAT_EVENT_PREDICATES
+        columns = [self._event_texts(facts[column].tolist(), flat) if column in EVENT_COLUMNS
+                   else map(str, facts[column].tolist())
+                   for column in COLUMNS[predicate]]
+        return [f"{predicate}({','.join(args)})" for args in zip(*columns)]
+
+    # -----------------------------
+    # AspResultsStore interface
+    # -----------------------------
+
+    def __contains__(self, story):
+        self._load()
+        return story in self.story_index
+
+    def get(self, story, predicate, default=None):
+        """atoms of one predicate for a story as strings (default if the story has none)"""
+        self._load()
+        i = self.story_index.get(story)
+        if i is None:
+            return default
+        if self.status[i] != OK:
+            marker = MARKERS[int(self.status[i])]
+            if predicate != marker:
+                return default
+            return self.errors[story] if self.status[i] == ERROR else True
+        if predicate not in COLUMNS or self.offsets[predicate][i] == self.offsets[predicate][i + 1]:
+            return default
+        return self.render(predicate, self.facts(story, predicate))
+
+    def story(self, story):
+        """all predicates of a story, shaped like its entry in asp_results.json"""
+        self._load()
+        i = self.story_index[story]
+        if self.status[i] != OK:
+            marker = MARKERS[int(self.status[i])]
+            return {marker: self.errors[story] if self.status[i] == ERROR else True}
+        return {pred: self.render(pred, self.facts(story, pred)) for pred in COLUMNS
+                if self.offsets[pred][i] < self.offsets[pred][i + 1]}
+
+
+if __name__ == "__main__":
+    # prefer the streamed results of entailment.run_instances, fall back to the compacted JSON
+    results_path = "results/asp_results.jsonl"
+    if not os.path.exists(results_path):
+        results_path = "results/asp_results.json"
+    n_stories = build_answer_sets(results_path)
+    print(f"Stored columnar answer sets for {n_stories} stories in {ANSWER_SETS_PATH}")
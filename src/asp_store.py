@@ -0,0 +1,114 @@
+# SQLite store of ASP results, indexed by story and predicate
+# lets the LLM pipeline look up the facts of a single story without loading asp_results.json
+
+import os
+import json
+import sqlite3
+
+STORE_PATH = "results/asp_results.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stories (
+    story TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS facts (
+    story TEXT NOT NULL,
+    predicate TEXT NOT NULL,
+    atoms TEXT NOT NULL,
+    PRIMARY KEY (story, predicate)
+) WITHOUT ROWID;
+"""
+
+
+def iter_results(results_path):
+    """
+    yield (story, result) pairs from a JSONL result stream (see entailment.run_instances)
+    or from a legacy asp_results.json file
+    """
+    if results_path.endswith(".jsonl"):
+        with open(results_path) as f:
+            for line in f:
+                if line.endswith("\n"):
+                    record = json.loads(line)
+                    yield record["file"], record["result"]
+    else:
+        with open(results_path) as f:
+            yield from json.load(f).items()
+
+
+def build_store(results_path, store_path=STORE_PATH):
+    """
+    (re)build the store from ASP results; the store is written to a temporary file first
+    and moved into place, so readers never see a half-built store
+
+    Return:
+        The number of stories in the store
+    """
+    tmp_path = store_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript(SCHEMA)
+    n_stories = 0
+    with conn:
+        for story, result in iter_results(results_path):
+            conn.execute("INSERT OR REPLACE INTO stories VALUES (?)", (story,))
+            conn.execute("DELETE FROM facts WHERE story = ?", (story,))
+            # predicate lists as well as UNSAT/TIMEOUT/ERROR markers are stored as JSON values
+            conn.executemany("INSERT INTO facts VALUES (?, ?, ?)",
+                             [(story, pred, json.dumps(value)) for pred, value in result.items()])
+            n_stories += 1
+    conn.close()
+
+    os.replace(tmp_path, store_path)
+    return n_stories
+
+
+class AspResultsStore:
+    """
+    read-only view of a store built by build_store
+
+    the connection is opened on first use and reopened in forked worker processes,
+    so the store can be created at import time and shared by many workers
+    """
+
+    def __init__(self, store_path=STORE_PATH):
+        self.store_path = store_path
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            if not os.path.exists(self.store_path):
+                raise FileNotFoundError(f"{self.store_path} not found, build it with asp_store.build_store")
+            self._conn = sqlite3.connect(f"file:{self.store_path}?mode=ro", uri=True, check_same_thread=False)
+            self._pid = os.getpid()
+        return self._conn
+
+    def __contains__(self, story):
+        row = self._connection().execute("SELECT 1 FROM stories WHERE story = ?", (story,)).fetchone()
+        return row is not None
+
+    def get(self, story, predicate, default=None):
+        """facts of one predicate for a story (default if the story has none)"""
+        row = self._connection().execute(
+            "SELECT atoms FROM facts WHERE story = ? AND predicate = ?", (story, predicate)
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def story(self, story):
+        """all predicates of a story, shaped like its entry in asp_results.json"""
+        rows = self._connection().execute(
+            "SELECT predicate, atoms FROM facts WHERE story = ?", (story,)
+        ).fetchall()
+        return {pred: json.loads(atoms) for pred, atoms in rows}
+
+
+if __name__ == "__main__":
+    # prefer the streamed results of entailment.run_instances, fall back to the compacted JSON
+    results_path = "results/asp_results.jsonl"
+    if not os.path.exists(results_path):
+        results_path = "results/asp_results.json"
+    n_stories = build_store(results_path)
+    print(f"Stored ASP results for {n_stories} stories in {STORE_PATH}")
@@ -0,0 +1,146 @@
+# asyncio batch runner for the LLM modules
+# runs many instances concurrently while keeping within requests-per-minute and tokens-per-minute limits
+
+import os
+import time
+import random
+import asyncio
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError
+from tracing import current_span, in_span
+
+
+class TokenBucket:
+    """token bucket holding up to one minute of budget, refilled continuously"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        # requests larger than the whole bucket would never fit, so they wait for a full bucket
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """requests-per-minute and tokens-per-minute limits (None disables a limit)"""
+
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    async def acquire(self, n_tokens):
+        if self.requests:
+            await self.requests.acquire(1)
+        if self.tokens:
+            await self.tokens.acquire(n_tokens)
+
+
+def estimate_tokens(request, completion_tokens=512):
+    """rough token count of a chat completion request (about four characters per token)"""
+    prompt_chars = sum(len(message["content"]) for message in request.get("messages", []))
+    return prompt_chars // 4 + request.get("max_tokens", completion_tokens)
+
+
+def is_retryable(error):
+    """rate limits, server errors and connection problems are worth retrying"""
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return isinstance(error, APIConnectionError)
+
+
+async def create_with_retry(client, limiter, max_retries=6, base_delay=1.0, max_delay=60.0, **request):
+    """chat completion through the rate limiter, retried with jittered exponential backoff"""
+    for attempt in range(max_retries + 1):
+        await limiter.acquire(estimate_tokens(request))
+        try:
+            return await client.chat.completions.create(**request)
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            current_span().add("retries")
+            await asyncio.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+
+def blocking_client(create, loop):
+    """
+    synchronous stand-in for OpenAI's client.chat.completions.create, so the existing run_instance
+    functions can run in worker threads while their requests go through create on the event loop
+    """
+    def blocking_create(**request):
+        # the request runs as a task on the loop, which does not see this thread's current span
+        return asyncio.run_coroutine_threadsafe(in_span(current_span(), create(**request)), loop).result()
+
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=blocking_create)))
+
+
+async def run_batch_async(subset, run_fn, client=None, concurrency=8, rpm=None, tpm=None, max_retries=6, label="",
+                          cache=None, limiter=None, on_result=None):
+    """
+    run run_fn(instance, client=...) over subset with at most concurrency instances in flight
+
+    Args:
+        subset (list) dataset instances
+        run_fn (callable) one of the modules' run_instance functions
+        client (AsyncOpenAI) any OpenAI-compatible async client (default: built from OPENAI_API_KEY,
+            and OPENAI_BASE_URL if set, e.g. to point at a local stand-in server)
+        rpm, tpm (int) requests and tokens per minute (None for no limit)
+        cache (CompletionCache) answer repeated requests from this cache instead of the API
+        limiter (RateLimiter) share rate limits with other batches running on the same loop (overrides rpm, tpm)
+        on_result (callable) called with (instance, result) as soon as each instance finishes
+
+    Return:
+        A dictionary mapping instance ids to results, in the order of subset
+    """
+    if client is None:
+        # retries are handled here, with the shared rate limiter
+        client = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"], max_retries=0)
+
+    loop = asyncio.get_running_loop()
+    if limiter is None:
+        limiter = RateLimiter(rpm, tpm)
+
+    async def create(**request):
+        response = cache.get(request) if cache is not None else None
+        if response is None:
+            response = await create_with_retry(client, limiter, max_retries, **request)
+            if cache is not None:
+                cache.put(request, response)
+        else:
+            current_span().add("cache_hits")
+        return response
+
+    sync_client = blocking_client(create, loop)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(i, instance):
+        async with semaphore:
+            print(f"{label}Processing {instance['id']} ({i+1}/{len(subset)})...")
+            try:
+                result = await loop.run_in_executor(pool, lambda: run_fn(instance, client=sync_client))
+            except Exception as e:
+                result = {"error": str(e)}
+            if on_result is not None:
+                on_result(instance, result)
+            return result
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outputs = await asyncio.gather(*(run_one(i, instance) for i, instance in enumerate(subset)))
+
+    results = {}
+    for instance, output in zip(subset, outputs):
+        results[instance["id"]] = output
+    return results
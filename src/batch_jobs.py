@@ -0,0 +1,372 @@
+# offline batch-job mode of the two-stage LLM pipeline (llm_module)
+# stage 1 and stage 2 requests are rendered to JSONL files, submitted as batch jobs, polled and ingested;
+# every step is checkpointed in a run directory, so an interrupted sweep continues where it stopped
+
+import os
+import json
+import time
+import uuid
+import shutil
+from llm_module import (fast_path_result, stage1_request, parse_stage1, stage2_request, parse_stage2, lookup_facts,
+                        llm_result, load_system_prompt, pipeline_options, MODEL, DATA, USE_ROUTER, USE_FAST_PATH,
+                        COMPACT_PROMPTS, ASP_SOURCE)
+from experiment_runner import sample_subset
+from predicate_router import route_question, CONFIDENCE_THRESHOLD
+from utils import write_atomic
+
+ENDPOINT = "/v1/chat/completions"
+RUNS_DIR = "batch_runs"
+
+# batch statuses after which a job produces no further output
+FINISHED = ("completed", "failed", "expired", "cancelled")
+
+
+# -----------------------------
+# Batch endpoints
+# -----------------------------
+
+class OpenAIBatches:
+    """the OpenAI Batch API"""
+
+    def __init__(self, client=None):
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+        self.client = client
+
+    def submit(self, requests_path) -> str:
+        with open(requests_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        job = self.client.batches.create(input_file_id=uploaded.id, endpoint=ENDPOINT, completion_window="24h")
+        return job.id
+
+    def status(self, job_id) -> str:
+        return self.client.batches.retrieve(job_id).status
+
+    def download(self, job_id, out_path):
+        """write the job's output lines (and error lines, if any) to out_path"""
+        job = self.client.batches.retrieve(job_id)
+        with open(out_path, "wb") as f:
+            for file_id in (job.output_file_id, job.error_file_id):
+                if file_id:
+                    f.write(self.client.files.content(file_id).content)
+
+
+def standin_response(body) -> str:
+    """
+    answer of the local stand-in: no predicates for stage 1 requests and the first candidate
+    for stage 2 requests (parsed from the question.txt layout)
+    """
+    prompt = body["messages"][-1]["content"]
+    if '"answer_choice"' not in prompt:
+        return json.dumps({"reasoning": "local stand-in", "predicate_choice": []})
+    candidates = prompt.split("candidate answers:\n", 1)[-1].split("\n\n", 1)[0].split("\n")
+    return json.dumps({"reasoning": "local stand-in", "answer_choice": candidates[0]})
+
+
+class LocalBatches:
+    """
+    file-based stand-in for the batch endpoint, for testing the pipeline offline
+
+    a job is a directory holding its input; it completes on its polls_to_complete-th status poll,
+    answering every request with respond(body) and writing output lines in the Batch API's format
+    """
+
+    def __init__(self, directory=".cache/local_batches", respond=standin_response, polls_to_complete=2):
+        self.directory = directory
+        self.respond = respond
+        self.polls_to_complete = polls_to_complete
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def _save(self, job_id, job):
+        write_atomic(os.path.join(self._job_dir(job_id), "job.json"), json.dumps(job))
+
+    def submit(self, requests_path) -> str:
+        job_id = f"batch_{uuid.uuid4().hex}"
+        os.makedirs(self._job_dir(job_id))
+        shutil.copy(requests_path, os.path.join(self._job_dir(job_id), "input.jsonl"))
+        self._save(job_id, {"status": "in_progress", "polls": 0})
+        return job_id
+
+    def status(self, job_id) -> str:
+        with open(os.path.join(self._job_dir(job_id), "job.json")) as f:
+            job = json.load(f)
+        if job["status"] == "in_progress":
+            job["polls"] += 1
+            if job["polls"] >= self.polls_to_complete:
+                self._run(job_id)
+                job["status"] = "completed"
+            self._save(job_id, job)
+        return job["status"]
+
+    def _run(self, job_id):
+        with open(os.path.join(self._job_dir(job_id), "input.jsonl")) as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        output = []
+        for line in lines:
+            body = line["body"]
+            content = self.respond(body)
+            prompt_tokens = sum(len(message["content"]) for message in body["messages"]) // 4
+            completion = {
+                "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                          "total_tokens": prompt_tokens + len(content) // 4},
+            }
+            output.append({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": line["custom_id"],
+                           "response": {"status_code": 200, "body": completion}, "error": None})
+        write_atomic(os.path.join(self._job_dir(job_id), "output.jsonl"),
+                     "".join(json.dumps(line) + "\n" for line in output))
+
+    def download(self, job_id, out_path):
+        shutil.copy(os.path.join(self._job_dir(job_id), "output.jsonl"), out_path)
+
+
+# -----------------------------
+# Run directory
+# -----------------------------
+
+def _path(run_dir, name):
+    return os.path.join(run_dir, name)
+
+
+def load_state(run_dir) -> dict:
+    with open(_path(run_dir, "state.json")) as f:
+        state = json.load(f)
+    # runs checkpointed before the options were recorded ran with router, fast path and compaction on
+    state.setdefault("options", pipeline_options(use_router=True, use_fast_path=True, compact_prompts=True))
+    return state
+
+
+def save_state(run_dir, state):
+    write_atomic(_path(run_dir, "state.json"), json.dumps(state, indent=2))
+
+
+def _write_json(run_dir, name, data):
+    write_atomic(_path(run_dir, name), json.dumps(data))
+
+
+def _read_json(run_dir, name):
+    with open(_path(run_dir, name)) as f:
+        return json.load(f)
+
+
+def _write_requests(run_dir, name, requests):
+    """write (custom_id, request) pairs as Batch API input lines"""
+    write_atomic(_path(run_dir, name), "".join(
+        json.dumps({"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": request}) + "\n"
+        for custom_id, request in requests))
+    return len(requests)
+
+
+def _read_output(run_dir, name) -> dict:
+    """custom_id -> response content (str) or {"error": ...} of a downloaded job output"""
+    outputs = {}
+    if not os.path.exists(_path(run_dir, name)):
+        return outputs
+    with open(_path(run_dir, name)) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                outputs[record["custom_id"]] = {"error": str(record.get("error") or response.get("body"))}
+            else:
+                outputs[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return outputs
+
+
+def prepare_run(run_dir, subset, options=None):
+    """start a run over the given instances with the given pipeline options (see llm_module.pipeline_options)"""
+    os.makedirs(run_dir, exist_ok=True)
+    _write_json(run_dir, "instances.json", subset)
+    save_state(run_dir, {"phase": "prepared", "model": MODEL, "options": options or pipeline_options(),
+                         "jobs": {}, "requests": {}})
+
+
+# -----------------------------
+# Steps
+# -----------------------------
+
+def render_stage1(run_dir, state):
+    """fast path and router first; stage 1 requests for the remaining questions"""
+    instances = _read_json(run_dir, "instances.json")
+    system_prompt = load_system_prompt()
+    options = state["options"]
+    stage1, requests = {}, []
+    for instance in instances:
+        result = fast_path_result(instance, options)
+        if result is not None:
+            stage1[instance["id"]] = {"result": result}
+            continue
+        request, query_prompt = stage1_request(instance["question"], system_prompt)
+        routed_choice, router_confidence, _ = route_question(instance["question"])
+        report = {"system_prompt_stage1": system_prompt, "query_prompt": query_prompt,
+                  "router_confidence": router_confidence}
+        if options["use_router"] and router_confidence >= CONFIDENCE_THRESHOLD:
+            stage1[instance["id"]] = {**report, "stage1_response": None, "stage1_source": "router",
+                                      "predicate_choice": routed_choice}
+        else:
+            stage1[instance["id"]] = {**report, "stage1_source": "llm"}
+            requests.append((f"stage1:{instance['id']}", request))
+    _write_json(run_dir, "stage1.json", stage1)
+    state["requests"]["stage1"] = _write_requests(run_dir, "stage1_requests.jsonl", requests)
+    return "stage1_rendered"
+
+
+def ingest_stage1_render_stage2(run_dir, state):
+    """predicate choices from the stage 1 output, ASP facts, and stage 2 requests"""
+    instances = _read_json(run_dir, "instances.json")
+    stage1 = _read_json(run_dir, "stage1.json")
+    outputs = _read_output(run_dir, "stage1_output.jsonl")
+    system_prompt = load_system_prompt()
+    options = state["options"]
+    stage2, requests = {}, []
+    for instance in instances:
+        entry = stage1[instance["id"]]
+        if "result" in entry:
+            continue
+        try:
+            if entry["stage1_source"] == "llm":
+                output = outputs.get(f"stage1:{instance['id']}", {"error": "no stage 1 output"})
+                if isinstance(output, dict):
+                    raise RuntimeError(output["error"])
+                entry["stage1_response"] = output
+                entry["predicate_choice"] = parse_stage1(output)
+            asp_facts = lookup_facts(instance, entry["predicate_choice"], options["asp_source"])
+            request, question_prompt, compaction = stage2_request(instance, asp_facts, system_prompt, options)
+        except Exception as e:
+            entry["result"] = {"error": str(e)}
+            continue
+        stage2[instance["id"]] = {"question_prompt": question_prompt, "compaction": compaction}
+        requests.append((f"stage2:{instance['id']}", request))
+    _write_json(run_dir, "stage1.json", stage1)
+    _write_json(run_dir, "stage2.json", stage2)
+    state["requests"]["stage2"] = _write_requests(run_dir, "stage2_requests.jsonl", requests)
+    return "stage2_rendered"
+
+
+def ingest_stage2(run_dir, state, output_path):
+    """answers from the stage 2 output, written to output_path in run_batch's results format"""
+    instances = _read_json(run_dir, "instances.json")
+    stage1 = _read_json(run_dir, "stage1.json")
+    stage2 = _read_json(run_dir, "stage2.json")
+    outputs = _read_output(run_dir, "stage2_output.jsonl")
+    system_prompt = load_system_prompt()
+    results = {}
+    for instance in instances:
+        entry = stage1[instance["id"]]
+        if "result" in entry:
+            results[instance["id"]] = entry["result"]
+            continue
+        output = outputs.get(f"stage2:{instance['id']}", {"error": "no stage 2 output"})
+        try:
+            if isinstance(output, dict):
+                raise RuntimeError(output["error"])
+            prompt = stage2[instance["id"]]
+            results[instance["id"]] = llm_result(instance, entry, system_prompt, prompt["question_prompt"],
+                                                 prompt["compaction"], output, parse_stage2(output),
+                                                 state["options"])
+        except Exception as e:
+            results[instance["id"]] = {"error": str(e)}
+    write_atomic(output_path, json.dumps(results, indent=2))
+    state["output_path"] = output_path
+    return "done"
+
+
+def submit(run_dir, state, stage, backend):
+    if state["requests"][stage] == 0:
+        # nothing to send (e.g. all questions routed): skip the job
+        return f"{stage}_retrieved"
+    state["jobs"][stage] = backend.submit(_path(run_dir, f"{stage}_requests.jsonl"))
+    return f"{stage}_submitted"
+
+
+def retrieve(run_dir, state, stage, backend):
+    """the next phase once the stage's job finished, else None"""
+    status = backend.status(state["jobs"][stage])
+    if status not in FINISHED:
+        return None
+    if status != "completed":
+        # no output: every request of the stage is recorded as an error at ingestion
+        print(f"{stage} job {state['jobs'][stage]} ended with status {status}")
+    else:
+        backend.download(state["jobs"][stage], _path(run_dir, f"{stage}_output.jsonl"))
+    return f"{stage}_retrieved"
+
+
+def advance(run_dir, backend, output_path):
+    """
+    run the next step of a run and checkpoint it; the phases are prepared, stage1_rendered,
+    stage1_submitted, stage1_retrieved, stage2_rendered, stage2_submitted, stage2_retrieved and done
+
+    Return:
+        The run's phase afterwards (unchanged while a submitted job is still running)
+    """
+    state = load_state(run_dir)
+    phase = state["phase"]
+    if phase == "prepared":
+        next_phase = render_stage1(run_dir, state)
+    elif phase == "stage1_rendered":
+        next_phase = submit(run_dir, state, "stage1", backend)
+    elif phase == "stage1_submitted":
+        next_phase = retrieve(run_dir, state, "stage1", backend)
+    elif phase == "stage1_retrieved":
+        next_phase = ingest_stage1_render_stage2(run_dir, state)
+    elif phase == "stage2_rendered":
+        next_phase = submit(run_dir, state, "stage2", backend)
+    elif phase == "stage2_submitted":
+        next_phase = retrieve(run_dir, state, "stage2", backend)
+    elif phase == "stage2_retrieved":
+        next_phase = ingest_stage2(run_dir, state, output_path)
+    else:
+        return phase
+
+    if next_phase is not None:
+        state["phase"] = next_phase
+        save_state(run_dir, state)
+        print(f"{run_dir}: {phase} -> {next_phase}")
+    return state["phase"]
+
+
+def run_batch_job(n=50, mode="random", output_path=f"results/llm_results_{MODEL}_{DATA}_batch.json", data=DATA,
+                  run_dir=None, backend=None, poll_interval=60, use_router=USE_ROUTER, use_fast_path=USE_FAST_PATH,
+                  compact_prompts=COMPACT_PROMPTS, asp_source=ASP_SOURCE):
+    """
+    the two-stage pipeline of llm_module.run_batch as batch jobs
+
+    Args:
+        run_dir (str) checkpoint directory of the run (default: batch_runs/<name of output_path>);
+            an existing run continues from its last completed step instead of sampling again
+        backend (OpenAIBatches or LocalBatches) the batch endpoint (default: OpenAIBatches())
+        poll_interval (float) seconds between status polls of a running job
+        use_router, use_fast_path, compact_prompts, asp_source pipeline options of a new run
+            (see llm_module.pipeline_options); an existing run keeps the options it started with
+    """
+    if run_dir is None:
+        run_dir = os.path.join(RUNS_DIR, os.path.splitext(os.path.basename(output_path))[0])
+    if backend is None:
+        backend = OpenAIBatches()
+
+    if not os.path.exists(_path(run_dir, "state.json")):
+        subset = sample_subset(data, n, mode)
+        prepare_run(run_dir, subset, pipeline_options(use_router=use_router, use_fast_path=use_fast_path,
+                                                      compact_prompts=compact_prompts, asp_source=asp_source))
+
+    while True:
+        phase = load_state(run_dir)["phase"]
+        if phase == "done":
+            break
+        if advance(run_dir, backend, output_path) == phase:
+            time.sleep(poll_interval)
+
+    print(f" Saved batch results to {output_path}")
+
+
+if __name__ == "__main__":
+    run_batch_job(n=500, mode="stratified")
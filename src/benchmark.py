@@ -0,0 +1,407 @@
+# benchmarks of the pipeline stages on synthetic stories of growing size
+# tg_to_asp, solving (per backend), prompt building and evaluation, from tens to hundreds of thousands of events
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import multiprocessing as mp
+from datetime import datetime
+import numpy as np
+
+from symbolic_module import tg_to_asp, TGQA_RELATIONS, parse_tgqa_event, timeqa_event_facts, clean_term
+from entailment import run_instance, derive_predicates, BACKENDS
+from prompt_generation import make_question_prompt, compact_question_prompt
+
+# evaluation.py lives at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from evaluation import evaluate_file
+
+ENCODING = "src/tg_reasoner.lp"
+STAGES = ("tg_to_asp", "solve", "prompt", "compact_prompt", "evaluate")
+SIZES = (10, 100, 1000, 10000, 100000)
+REPORT_PATH = "benchmarks/latest.json"
+BASELINE_PATH = "benchmarks/baseline.json"
+
+# fixed default date for TimeQA conversion, so output does not depend on the day the benchmark runs
+DEFAULT_DATE = datetime(2000, 1, 1)
+MONTH_NAMES = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+# a case counts as a regression if it is this much slower (p50) or uses this much more memory (stage RSS)
+# than the baseline, ignoring latency differences below MIN_LATENCY_DELTA seconds and RSS differences
+# below MIN_RSS_DELTA_MB
+TOLERANCE = 0.25
+MIN_LATENCY_DELTA = 0.005
+MIN_RSS_DELTA_MB = 5
+
+
+# -----------------------------
+# Synthetic stories
+# -----------------------------
+
+def synthetic_tg(n_events: int, tg_type="TGQA", seed=0) -> list:
+    """
+    a temporal graph with n_events events in the string format of the dataset's TG column:
+    TGQA entries "(S relation O) starts at Y" / "... ends at Y", TimeQA entries "Mon Y - Y : S's employer is ( O )"
+
+    subjects are shared by about four events each, start years are spread over two centuries
+    """
+    rng = random.Random(seed)
+    relations = list(TGQA_RELATIONS)
+    n_subjects = max(1, n_events // 4)
+
+    TG = []
+    for i in range(n_events):
+        subject = f"Person {rng.randrange(n_subjects)}"
+        start = rng.randint(1800, 2020)
+        end = start + rng.randint(0, 40)
+        if tg_type == "TGQA":
+            event = f"{subject} {rng.choice(relations)} Entity {i}"
+            TG.append(f"({event}) starts at {start}")
+            TG.append(f"({event}) ends at {end}")
+        else:
+            TG.append(f"{rng.choice(MONTH_NAMES)} {start} - {end} : {subject}'s employer is ( Entity {i} )")
+    return TG
+
+
+def synthetic_question(TG: list, tg_type="TGQA"):
+    """a question about the first event of a synthetic TG and its candidates"""
+    if tg_type == "TGQA":
+        event = TG[0].split(") starts at")[0].lstrip("(")
+        year = int(TG[0].rsplit(" ", 1)[1])
+        return f"When did the event ({event}) start?", [str(year + k) for k in range(-2, 3)]
+    subject = TG[0].split(" : ")[1].split("'s")[0]
+    year = int(TG[0].split(" - ")[0].split()[1])
+    entities = [entry.split("( ")[1].rstrip(" )") for entry in TG[:5]]
+    return f"{subject} was an employee for whom between Apr {year} and Oct {year}?", entities + ["Unknown"]
+
+
+def write_instance(TG: list, tg_type: str, workdir: str, name: str) -> str:
+    fpath = os.path.join(workdir, f"{name}.lp")
+    with open(fpath, "w") as f:
+        f.write(tg_to_asp(TG, tg_type, DEFAULT_DATE))
+    return fpath
+
+
+def synthetic_results(n_instances: int, tg_type="TGQA", seed=0) -> dict:
+    """a results file in the LLM modules' schema, with about 80% correct answers"""
+    rng = random.Random(seed)
+    results = {}
+    for i in range(n_instances):
+        instance_id = f"story{i // 10}_Q{i % 10}" if tg_type == "TGQA" else f"/wiki/Person_{i}#P{i % 7}"
+        candidates = [f"Entity {i} {k}" for k in range(4)]
+        gold = candidates[0]
+        results[instance_id] = {
+            "answer_choice": gold if rng.random() < 0.8 else rng.choice(candidates[1:]),
+            "gold_answer": [gold],
+            "instance_question": f"Question {i}?",
+            "instance_candidates": candidates,
+            "instance_id": instance_id,
+        }
+    return results
+
+
+# -----------------------------
+# Stages
+# -----------------------------
+# each stage runs one repetition on a story of size n and returns (seconds, items processed, derived fact counts)
+
+def clear_converter_caches():
+    # measure conversion of unseen stories, not memoized lookups
+    for fn in (parse_tgqa_event, timeqa_event_facts, clean_term):
+        fn.cache_clear()
+
+
+def stage_tg_to_asp(tg_type, n, backend, seed, workdir, timeout):
+    TG = synthetic_tg(n, tg_type, seed)
+    clear_converter_caches()
+    start = time.perf_counter()
+    asp = tg_to_asp(TG, tg_type, DEFAULT_DATE)
+    elapsed = time.perf_counter() - start
+    return elapsed, n, {"event": asp.count("\n")}
+
+
+def stage_solve(tg_type, n, backend, seed, workdir, timeout):
+    fpath = write_instance(synthetic_tg(n, tg_type, seed), tg_type, workdir, f"solve_{seed}")
+    start = time.perf_counter()
+    result = run_instance("clingo", ENCODING, fpath, timeout, backend)
+    elapsed = time.perf_counter() - start
+    if "TIMEOUT" in result:
+        raise TimeoutError(f"solving exceeded {timeout}s")
+    if "ERROR" in result:
+        raise RuntimeError(result["ERROR"])
+    return elapsed, n, {pred: len(atoms) for pred, atoms in result.items() if isinstance(atoms, list)}
+
+
+def prompt_inputs(tg_type, n, seed, workdir, timeout):
+    TG = synthetic_tg(n, tg_type, seed)
+    fpath = write_instance(TG, tg_type, workdir, f"prompt_{seed}")
+    question, candidates = synthetic_question(TG, tg_type)
+    # starts_at is linear in the events, so building the inputs stays cheap at every size
+    asp_facts = derive_predicates(ENCODING, fpath, ["starts_at"], timeout)["starts_at"]
+    tg_str = "\n".join(TG)
+    return question, asp_facts, "\n".join(candidates), tg_str
+
+
+def stage_prompt(tg_type, n, backend, seed, workdir, timeout):
+    question, asp_facts, candidates, tg_str = prompt_inputs(tg_type, n, seed, workdir, timeout)
+    start = time.perf_counter()
+    prompt = make_question_prompt(question, asp_facts, candidates, tg_str, tg_str)
+    elapsed = time.perf_counter() - start
+    return elapsed, n, {"starts_at": len(asp_facts), "prompt_chars": len(prompt)}
+
+
+def stage_compact_prompt(tg_type, n, backend, seed, workdir, timeout):
+    question, asp_facts, candidates, tg_str = prompt_inputs(tg_type, n, seed, workdir, timeout)
+    start = time.perf_counter()
+    prompt, report = compact_question_prompt(question, asp_facts, candidates, tg_str, tg_str, token_budget=4000)
+    elapsed = time.perf_counter() - start
+    return elapsed, n, {"starts_at": len(asp_facts), "facts_kept": report["facts_after"],
+                        "prompt_chars": len(prompt)}
+
+
+def stage_evaluate(tg_type, n, backend, seed, workdir, timeout):
+    path = os.path.join(workdir, f"results_{seed}.json")
+    with open(path, "w") as f:
+        json.dump(synthetic_results(n, tg_type, seed), f, indent=2)
+    start = time.perf_counter()
+    evaluate_file(path)
+    elapsed = time.perf_counter() - start
+    return elapsed, n, {}
+
+
+STAGE_FUNCTIONS = {
+    "tg_to_asp": stage_tg_to_asp,
+    "solve": stage_solve,
+    "prompt": stage_prompt,
+    "compact_prompt": stage_compact_prompt,
+    "evaluate": stage_evaluate,
+}
+
+
+# -----------------------------
+# Isolated runs
+# -----------------------------
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux; children covers the clingo subprocesses
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+def _case_worker(case, max_memory_mb, conn):
+    """
+    run all repetitions of one case in a fresh process, so its peak RSS is its own; the RSS of the
+    interpreter and the imported modules is measured before the stage runs and reported separately
+    """
+    if max_memory_mb:
+        limit = max_memory_mb * 1024 ** 2
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    baseline_rss = peak_rss_mb()
+
+    stage = STAGE_FUNCTIONS[case["stage"]]
+    latencies, items, derived = [], 0, {}
+    status = "ok"
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            for seed in range(case["repeats"]):
+                elapsed, n_items, derived = stage(case["format"], case["size"], case["backend"], seed, workdir,
+                                                  case["timeout"])
+                latencies.append(elapsed)
+                items += n_items
+        except MemoryError:
+            status = "MEMORY"
+        except TimeoutError:
+            status = "TIMEOUT"
+        except Exception as e:
+            status = f"ERROR: {e}"
+
+    peak_rss = peak_rss_mb()
+    conn.send({
+        "status": status,
+        "latencies": latencies,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "throughput": items / sum(latencies) if latencies and sum(latencies) > 0 else None,
+        "baseline_rss_mb": round(baseline_rss, 1),
+        "peak_rss_mb": round(peak_rss, 1),
+        "stage_rss_mb": round(peak_rss - baseline_rss, 1),
+        "derived": derived,
+    })
+    conn.close()
+
+
+def run_case(case, max_memory_mb=8192):
+    """
+    run one case in a spawned process, killing it after its time limit (repeats x timeout plus slack)
+    """
+    ctx = mp.get_context("spawn")
+    receiver, sender = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_case_worker, args=(case, max_memory_mb, sender))
+    proc.start()
+    sender.close()
+
+    try:
+        if receiver.poll(case["repeats"] * case["timeout"] + 30):
+            result = receiver.recv()
+        else:
+            result = {"status": "TIMEOUT"}
+    except EOFError:
+        # killed without reporting, e.g. by the kernel's OOM killer
+        result = {"status": "CRASHED"}
+
+    proc.join(timeout=5)
+    if proc.is_alive():
+        proc.kill()
+        proc.join()
+    if result["status"] == "CRASHED":
+        result["status"] = f"CRASHED (exit code {proc.exitcode})"
+    return {**case, **result}
+
+
+# -----------------------------
+# Reports
+# -----------------------------
+
+def case_key(case) -> str:
+    return f"{case['stage']}/{case['format']}/{case['backend']}/{case['size']}"
+
+
+def growth_exponents(cases, min_size=100):
+    """
+    fitted exponent k of latency ~ size^k and derived facts ~ size^k per stage, format and backend
+    (about 1 for linear stages, 2 for the pairwise predicates), from the completed cases of at least min_size
+    """
+    groups = {}
+    for case in cases:
+        if case["status"] == "ok" and case["size"] >= min_size:
+            groups.setdefault(f"{case['stage']}/{case['format']}/{case['backend']}", []).append(case)
+
+    def slope(sizes, values):
+        points = [(s, v) for s, v in zip(sizes, values) if v and v > 0]
+        if len(points) < 2:
+            return None
+        x, y = np.log([p[0] for p in points]), np.log([p[1] for p in points])
+        return round(float(np.polyfit(x, y, 1)[0]), 2)
+
+    exponents = {}
+    for group, group_cases in groups.items():
+        sizes = [case["size"] for case in group_cases]
+        derived = {}
+        for pred in sorted({pred for case in group_cases for pred in case["derived"]}):
+            k = slope(sizes, [case["derived"].get(pred, 0) for case in group_cases])
+            if k is not None:
+                derived[pred] = k
+        exponents[group] = {"latency": slope(sizes, [case["p50"] for case in group_cases]), "derived": derived}
+    return exponents
+
+
+def compare_to_baseline(cases, baseline_cases, tolerance=TOLERANCE):
+    """
+    regressions against a baseline report: slower p50, more memory used by the stage (peak minus baseline RSS,
+    or the peak for reports that predate stage_rss_mb), or a case that no longer completes
+
+    Return:
+        A list of (case key, description) pairs
+    """
+    baseline = {case_key(case): case for case in baseline_cases}
+    regressions = []
+    for case in cases:
+        old = baseline.get(case_key(case))
+        if old is None or old["status"] != "ok":
+            continue
+        if case["status"] != "ok":
+            regressions.append((case_key(case), f"{case['status']} (baseline: ok)"))
+            continue
+        if case["p50"] > old["p50"] * (1 + tolerance) and case["p50"] - old["p50"] > MIN_LATENCY_DELTA:
+            regressions.append((case_key(case), f"p50 {old['p50']:.4f}s -> {case['p50']:.4f}s"))
+        rss = "stage_rss_mb" if "stage_rss_mb" in old else "peak_rss_mb"
+        if case[rss] > old[rss] * (1 + tolerance) and case[rss] - old[rss] > MIN_RSS_DELTA_MB:
+            regressions.append((case_key(case), f"{rss[:-3].replace('_', ' ')} {old[rss]}MB -> {case[rss]}MB"))
+    return regressions
+
+
+def run_benchmarks(sizes=SIZES, stages=STAGES, formats=("TGQA", "TimeQA"), backends=("numpy", "clingo_api"),
+                   repeats=5, timeout=300, max_memory_mb=8192, out_path=REPORT_PATH):
+    """
+    run every (stage, format, backend, size) case and write the report to out_path
+
+    sizes are run in increasing order; once a case fails (timeout, memory, crash), the larger sizes
+    of the same stage, format and backend are skipped
+    """
+    cases = []
+    for stage in stages:
+        for tg_type in formats:
+            for backend in (backends if stage == "solve" else ["-"]):
+                failed = False
+                for size in sorted(sizes):
+                    case = {"stage": stage, "format": tg_type, "backend": backend, "size": size,
+                            "repeats": repeats, "timeout": timeout}
+                    if failed:
+                        cases.append({**case, "status": "SKIPPED"})
+                        print(f"{case_key(case):40} {'SKIPPED':>10}")
+                        continue
+                    result = run_case(case, max_memory_mb)
+                    cases.append(result)
+                    failed = result["status"] != "ok"
+
+                    line = f"{case_key(case):40} {result['status']:>10}"
+                    if result["status"] == "ok":
+                        line += (f"  p50 {result['p50']:9.4f}s  p95 {result['p95']:9.4f}s"
+                                 f"  {result['throughput']:12.0f} items/s  {result['peak_rss_mb']:8.1f}MB"
+                                 f" (stage {result['stage_rss_mb']:+.1f}MB)")
+                    print(line)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+        "cases": cases,
+        "growth": growth_exponents(cases),
+    }
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print("\nGrowth exponents (size^k):")
+    for group, exponents in report["growth"].items():
+        derived = ", ".join(f"{pred} {k}" for pred, k in exponents["derived"].items())
+        print(f"  {group}: latency {exponents['latency']}" + (f"; {derived}" if derived else ""))
+    print(f"Report written to {out_path}")
+    return report
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    arg_parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    arg_parser.add_argument("--formats", nargs="+", choices=["TGQA", "TimeQA"], default=["TGQA", "TimeQA"])
+    arg_parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=["numpy", "clingo_api"])
+    arg_parser.add_argument("--repeats", type=int, default=5)
+    arg_parser.add_argument("--timeout", type=int, default=300, help="seconds per repetition")
+    arg_parser.add_argument("--max-memory-mb", type=int, default=8192)
+    arg_parser.add_argument("--out", default=REPORT_PATH)
+    arg_parser.add_argument("--baseline", help=f"compare against a saved report, e.g. {BASELINE_PATH}")
+    arg_parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = arg_parser.parse_args()
+
+    report = run_benchmarks(args.sizes, args.stages, args.formats, args.backends, args.repeats, args.timeout,
+                            args.max_memory_mb, args.out)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(report["cases"], json.load(f)["cases"], args.tolerance)
+        for key, description in regressions:
+            print(f"REGRESSION {key}: {description}")
+        print(f"{len(regressions)} regressions against {args.baseline}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,126 @@
+# persistent, content-addressed cache for chat completion calls
+# identical requests (model, messages, temperature, other parameters) are answered from disk
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from types import SimpleNamespace
+from openai.types.chat import ChatCompletion
+from tracing import current_span
+
+CACHE_PATH = ".cache/chat_completions.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+def request_key(request: dict) -> str:
+    """sha256 of the canonical JSON form of a chat completion request"""
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+class CompletionCache:
+    """
+    SQLite-backed cache of chat completion responses
+
+    the database runs in WAL mode so many worker processes can read and write it concurrently;
+    entries older than max_age_days are dropped, and the least recently used entries are dropped
+    once the stored responses exceed max_bytes
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=1024 ** 3, max_age_days=90, evict_every=100):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # one connection per process, shared by its threads under self._lock
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self._pid = os.getpid()
+            self._evict()
+        return self._conn
+
+    def get(self, request: dict):
+        """cached ChatCompletion for request, or None; cached responses are marked with _from_cache"""
+        key = request_key(request)
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT response FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        response = ChatCompletion.model_validate_json(row[0])
+        # spans count the tokens of cached responses separately from the tokens actually spent
+        response._from_cache = True
+        return response
+
+    def put(self, request: dict, response) -> None:
+        text = response.model_dump_json()
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                         (request_key(request), text, len(text), now, now))
+            self._puts += 1
+            if self._puts % self.evict_every == 0:
+                self._evict()
+
+    def _evict(self):
+        conn = self._conn
+        conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.max_age_days * 86400,))
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            stale.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+
+def cached_client(client, cache: CompletionCache):
+    """wrap an OpenAI client so chat.completions.create is answered from cache when possible"""
+    def create(**request):
+        response = cache.get(request)
+        if response is None:
+            response = client.chat.completions.create(**request)
+            cache.put(request, response)
+        else:
+            current_span().add("cache_hits")
+        return response
+
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)), cache=cache)
@@ -0,0 +1,105 @@
+# local, memory-mapped snapshots of the TGQA dataset splits
+# exported once from the Hugging Face hub; afterwards loading, lookup and sampling work offline and on row indices
+
+import os
+import json
+import random
+from datasets import load_dataset, load_from_disk
+
+SNAPSHOT_DIR = "snapshots"
+DATASET_NAME = "sxiong/TGQA"
+
+
+def snapshot_path(config: str, split: str, snapshot_dir=SNAPSHOT_DIR) -> str:
+    return os.path.join(snapshot_dir, config, split)
+
+
+def build_index(dataset) -> dict:
+    """
+    id -> row and Q-Type -> rows, read column-wise without materializing the rows
+
+    Q-Types are listed in order of first appearance and rows in dataset order,
+    which keeps index-based sampling identical to sampling the materialized rows
+    """
+    ids = {instance_id: row for row, instance_id in enumerate(dataset["id"])}
+    qtype_column = dataset["Q-Type"] if "Q-Type" in dataset.column_names else [None] * len(dataset)
+    qtypes = {}
+    for row, qtype in enumerate(qtype_column):
+        qtypes.setdefault(qtype or "Unknown", []).append(row)
+    return {"ids": ids, "qtypes": qtypes}
+
+
+def export_snapshot(config: str, split: str, snapshot_dir=SNAPSHOT_DIR) -> str:
+    """download one split and store it as Arrow files plus index.json"""
+    path = snapshot_path(config, split, snapshot_dir)
+    dataset = load_dataset(DATASET_NAME, config)[split]
+    dataset.save_to_disk(path)
+    with open(os.path.join(path, "index.json"), "w") as f:
+        json.dump(build_index(dataset), f)
+    return path
+
+
+def load_split(config: str, split: str, snapshot_dir=SNAPSHOT_DIR):
+    """
+    memory-mapped dataset split and its index, exporting the snapshot first if it does not exist yet
+
+    Return:
+        (dataset, index) with index as built by build_index
+    """
+    path = snapshot_path(config, split, snapshot_dir)
+    if not os.path.exists(os.path.join(path, "index.json")):
+        export_snapshot(config, split, snapshot_dir)
+    with open(os.path.join(path, "index.json")) as f:
+        index = json.load(f)
+    return load_from_disk(path), index
+
+
+def get_instance(dataset, index, instance_id: str) -> dict:
+    return dataset[index["ids"][instance_id]]
+
+
+# -----------------------------
+# Index-only sampling
+# -----------------------------
+
+def sample_random_rows(n_rows: int, n=50, seed=42) -> list:
+    # random.sample draws positions depending only on the population size,
+    # so these are the rows random.sample(list(dataset), n) would pick
+    random.seed(seed)
+    return random.sample(range(n_rows), n)
+
+
+def sample_stratified_rows(qtypes: dict, n=50, seed=42) -> list:
+    random.seed(seed)
+
+    # if all Q-Types are "Unknown", just sample randomly
+    if len(qtypes) == 1 and "Unknown" in qtypes:
+        return sample_random_rows(len(qtypes["Unknown"]), n, seed)
+
+    n_types = len(qtypes)
+    per_type = max(1, n // n_types)
+
+    sampled = []
+    for qtype, rows in qtypes.items():
+        if rows:
+            sampled.extend(random.sample(rows, min(per_type, len(rows))))
+
+    return sampled
+
+
+def sample_rows(dataset, index, n=50, mode="random", seed=42) -> list:
+    """sample instances by row index, only reading the selected rows"""
+    if mode == "random":
+        rows = sample_random_rows(len(dataset), n, seed)
+    elif mode == "stratified":
+        rows = sample_stratified_rows(index["qtypes"], n, seed)
+    else:
+        raise ValueError("mode must be 'random' or 'stratified'")
+    return [dataset[row] for row in rows]
+
+
+if __name__ == "__main__":
+    # export everything the pipeline reads, so later runs work offline
+    for config, split in [("TGQA_Story_TG_Trans", "test"), ("TimeQA_Story_TG_Trans", "test"),
+                          ("TempReason_Story_TG_Trans", "test"), ("TGQA_TGR", "test"), ("TimeQA_TGR", "hard_test")]:
+        print(f"Exported {export_snapshot(config, split)}")
@@ -2,57 +2,775 @@
 
 import os
 import json
+import argparse
+import time
+import tempfile
+import pickle
+import select
+import signal
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from subprocess import run, PIPE, TimeoutExpired
+import clingo
+from clingo.ast import parse_files, ProgramBuilder, Transformer, ASTType, Location, Position, Variable, \
+    SymbolicAtom, SymbolicTerm, Function, Literal, Sign
+from vectorized_reasoner import solve_file
+from reasoning_cache import ReasoningCache, encoding_digest, facts_digest, result_key
 
-def call_clingo(clingo, input_names, timeout):
-    cmd = [clingo, "--warn=none", "--outf=2"] + input_names
+# backends available to run_instances:
+#   "clingo"     runs the encoding through a clingo subprocess per instance
+#   "clingo_api" solves in-process through the clingo Python API, parsing the encoding once per process
+#   "numpy"      derives the predicates of tg_reasoner.lp natively (the encoding file is not read)
+BACKENDS = ("clingo", "clingo_api", "numpy")
+
+# encodings available to run_instances:
+#   "original"  tg_reasoner.lp
+#   "scalable"  tg_reasoner_scalable.lp, the same predicates with ordering computed along a successor chain
+#               of start times and optional caps on the pairwise predicates, set through the constants
+#               pair_window (relate each event only to the next pair_window events in start order, 0: no cap)
+#               and pair_scope (all, or subject to relate only events sharing their subject)
+ENCODINGS = {"original": "src/tg_reasoner.lp", "scalable": "src/tg_reasoner_scalable.lp"}
+
+# predicates relating two events, which the scalable encoding's caps restrict
+PAIRWISE_PREDICATES = ("longer_than", "time_passed", "was_still_happening")
+
+# settings of the scalable encoding checked against the original by --check-encoding: uncapped, which must
+# be identical, and capped to the next 3 events and/or to events sharing their subject
+AGREEMENT_CONSTS = [{"pair_window": 0, "pair_scope": "all"}, {"pair_window": 3, "pair_scope": "all"},
+                    {"pair_window": 0, "pair_scope": "subject"}, {"pair_window": 3, "pair_scope": "subject"}]
+
+# adaptive timeouts (opt-in, see run_instances): every instance gets at least MIN_TIMEOUT seconds plus a share
+# that grows with the number of event pairs (time_passed, longer_than and was_still_happening are quadratic in
+# the events); these are rough guesses, not calibrated against solve times, so by default every instance gets
+# the flat timeout
+MIN_TIMEOUT = 10
+SECONDS_PER_EVENT_PAIR = 0.01
+
+# parsed encodings per process, so each worker reads and parses an encoding only once
+_parsed_encodings = {}
+
+# encoding slices per (encoding, predicates) and derived facts per (encoding, instance, predicate),
+# used by derive_predicates to ground and solve only what a question needs
+_encoding_slices = {}
+_derived_facts = {}
+
+# batched solving (run_instances with batch=True): many small stories are grounded and solved in one call
+# with a story-scoped copy of the encoding; a batch is closed once its stories' event pairs exceed
+# BATCH_EVENT_PAIRS or it holds BATCH_MAX_STORIES stories, so large stories are still solved alone
+BATCH_EVENT_PAIRS = 5000
+BATCH_MAX_STORIES = 200
+STORY_SCOPE = "story_scope"
+_scoped_encodings = {}
+
+def const_options(consts):
+    """clingo command line options setting the given constants (name -> value)"""
+    return [f"--const={name}={value}" for name, value in (consts or {}).items()]
+
+def call_clingo(clingo, input_names, timeout, consts=None):
+    cmd = [clingo, "--warn=none", "--outf=2"] + const_options(consts) + input_names
     output = run(cmd, stdout=PIPE, stderr=PIPE, timeout=timeout)
     if output.stderr:
         raise RuntimeError(f"Clingo error: {output.stderr.decode()}")
     return json.loads(output.stdout)
 
-def run_instances(clingo_bin, encoding, instance_dirs, timeout=30, out_json="results.json"):
-    results = {}
+def group_atoms(atoms):
+    """group shown atoms by predicate name"""
+    preds = {}
+    for atom in atoms:
+        pred = atom.split("(")[0] if "(" in atom else atom
+        preds.setdefault(pred, []).append(atom)
+    return preds
 
-    for inst_dir in instance_dirs:
-        for fname in sorted(os.listdir(inst_dir)):
-            if not fname.endswith(".lp"):
-                continue
-            fpath = os.path.join(inst_dir, fname)
-            try:
-                data = call_clingo(clingo_bin, [encoding, fpath], timeout)
-                instance_result = {}
-
-                if data["Result"] == "UNSATISFIABLE":
-                    instance_result["UNSAT"] = True
-                else:
-                    atoms = []
-                    for call in data["Call"]:
-                        for witness in call.get("Witnesses", []):
-                            atoms.extend(witness.get("Value", []))
-
-                    # group by predicate name
-                    preds = {}
-                    for atom in atoms:
-                        pred = atom.split("(")[0] if "(" in atom else atom
-                        preds.setdefault(pred, []).append(atom)
-                    instance_result = preds
-
-                results[fname] = instance_result
+def solve_with_clingo(clingo_bin, encoding, fpath, timeout, consts=None):
+    data = call_clingo(clingo_bin, [encoding, fpath], timeout, consts)
+
+    if data["Result"] == "UNSATISFIABLE":
+        return {"UNSAT": True}
+
+    atoms = []
+    for call in data["Call"]:
+        for witness in call.get("Witnesses", []):
+            atoms.extend(witness.get("Value", []))
+
+    return group_atoms(atoms)
+
+def load_encoding(encoding):
+    """parse an encoding file into AST statements (cached per process)"""
+    if encoding not in _parsed_encodings:
+        statements = []
+        parse_files([encoding], statements.append)
+        _parsed_encodings[encoding] = statements
+    return _parsed_encodings[encoding]
+
+class _PredicateCollector(Transformer):
+    """collects the names of all predicates occurring in the visited AST nodes"""
+
+    def __init__(self):
+        self.names = set()
+
+    def visit_SymbolicAtom(self, atom):
+        if atom.symbol.ast_type == ASTType.Function:
+            self.names.add(atom.symbol.name)
+        return atom
+
+def _predicate_names(*nodes):
+    collector = _PredicateCollector()
+    for node in nodes:
+        collector(node)
+    return collector.names
+
+def encoding_slice(encoding, predicates):
+    """
+    the statements of an encoding needed to derive the given predicates:
+    rules defining them and, transitively, the rules their bodies depend on
+    """
+    key = (encoding, frozenset(predicates))
+    if key not in _encoding_slices:
+        statements = load_encoding(encoding)
+
+        # predicate dependency graph (head name -> names used in the body)
+        depends_on = {}
+        for statement in statements:
+            if statement.ast_type == ASTType.Rule:
+                for head in _predicate_names(statement.head):
+                    depends_on.setdefault(head, set()).update(_predicate_names(*statement.body))
+
+        needed = set()
+        todo = list(predicates)
+        while todo:
+            pred = todo.pop()
+            if pred not in needed:
+                needed.add(pred)
+                todo.extend(depends_on.get(pred, ()))
+
+        _encoding_slices[key] = [statement for statement in statements
+                                 if statement.ast_type != ASTType.Rule
+                                 or _predicate_names(statement.head) & needed]
+    return _encoding_slices[key]
+
+def call_in_child(fn, args, timeout, name):
+    """
+    fn(*args) in a forked child process that is killed once timeout seconds have passed, as call_clingo kills
+    its subprocess (clingo cannot interrupt grounding, so this is the only way to bound it in-process);
+    the child inherits the parsed encodings, and exceptions raised by fn are raised here
 
+    Return:
+        The return value of fn, which must be picklable
+    """
+    if not hasattr(os, "fork"):
+        return fn(*args)
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            try:
+                payload = pickle.dumps(("result", fn(*args)))
             except TimeoutExpired:
-                results[fname] = {"TIMEOUT": True}
+                payload = pickle.dumps(("timeout", None))
             except Exception as e:
-                results[fname] = {"ERROR": str(e)}
+                try:
+                    payload = pickle.dumps(("error", e))
+                except Exception:
+                    payload = pickle.dumps(("error", RuntimeError(str(e))))
+            with os.fdopen(write_fd, "wb") as out:
+                out.write(payload)
+        finally:
+            os._exit(0)
+
+    os.close(write_fd)
+    deadline = time.monotonic() + timeout
+    chunks = []
+    try:
+        with os.fdopen(read_fd, "rb") as pipe:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([pipe], [], [], remaining)[0]:
+                    os.kill(pid, signal.SIGKILL)
+                    raise TimeoutExpired(name, timeout)
+                chunk = os.read(pipe.fileno(), 1 << 20)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+    finally:
+        os.waitpid(pid, 0)
+
+    if not chunks:
+        raise RuntimeError(f"solver process for {name} exited without a result")
+    status, value = pickle.loads(b"".join(chunks))
+    if status == "timeout":
+        raise TimeoutExpired(name, timeout)
+    if status == "error":
+        raise value
+    return value
+
+def solve_in_process(encoding, fpath, timeout, predicates=None, consts=None):
+    """
+    solve one instance in this process with the cached encoding
+
+    raises TimeoutExpired when solving exceeds what is left of timeout after grounding (grounding itself
+    cannot be interrupted), RuntimeError on clingo errors, and returns {"UNSAT": True} for unsatisfiable
+    instances; if predicates is given, only the rules needed for them are grounded and only their atoms are returned
+    """
+    started = time.monotonic()
+    messages = []
+    ctl = clingo.Control(["--warn=none"] + const_options(consts), logger=lambda code, msg: messages.append(msg))
+
+    try:
+        with ProgramBuilder(ctl) as builder:
+            statements = load_encoding(encoding) if predicates is None else encoding_slice(encoding, predicates)
+            for statement in statements:
+                builder.add(statement)
+        ctl.load(fpath)
+        ctl.ground([("base", [])])
+    except RuntimeError as e:
+        raise RuntimeError(f"Clingo error: {''.join(messages) or e}")
+
+    # collect shown atoms straight from the model, grouped by predicate name
+    preds = {}
+    def on_model(model):
+        for symbol in model.symbols(shown=True):
+            if predicates is None or symbol.name in predicates:
+                preds.setdefault(symbol.name, []).append(str(symbol))
+
+    remaining = timeout - (time.monotonic() - started)
+    with ctl.solve(on_model=on_model, async_=True) as handle:
+        if remaining <= 0 or not handle.wait(remaining):
+            handle.cancel()
+            raise TimeoutExpired(fpath, timeout)
+        result = handle.get()
+
+    if result.unsatisfiable:
+        return {"UNSAT": True}
+    return preds
+
+def solve_with_clingo_api(encoding, fpath, timeout, predicates=None, consts=None):
+    """
+    solve one instance through the clingo Python API with the encoding parsed once per process
+
+    mirrors solve_with_clingo: grounding and solving run in a forked child (see call_in_child) that is killed
+    when they exceed timeout, raising TimeoutExpired; RuntimeError on clingo errors, and {"UNSAT": True}
+    for unsatisfiable instances (see solve_in_process for predicates)
+    """
+    # parse (and slice) the encoding here, so every child inherits it instead of parsing it again
+    if predicates is None:
+        load_encoding(encoding)
+    else:
+        encoding_slice(encoding, predicates)
+    return call_in_child(solve_in_process, (encoding, fpath, timeout, predicates, consts), timeout, fpath)
+
+def derive_predicates(encoding, fpath, predicates, timeout=30):
+    """
+    derive only the given predicates for one instance, memoized per (instance, predicate)
+
+    runs in this process (it is called from the LLM pipeline's worker threads, which must not fork),
+    so timeout only bounds solving
+
+    Return:
+        A dictionary mapping each requested predicate to its atoms (empty if it has none)
+    """
+    missing = [pred for pred in predicates if (encoding, fpath, pred) not in _derived_facts]
+    if missing:
+        result = solve_in_process(encoding, fpath, timeout, predicates=missing)
+        for pred in missing:
+            _derived_facts[(encoding, fpath, pred)] = result.get(pred, [])
+    return {pred: _derived_facts[(encoding, fpath, pred)] for pred in predicates}
+
+def solve_instance(clingo_bin, encoding, fpath, timeout, backend="clingo", consts=None):
+    if backend == "clingo":
+        return solve_with_clingo(clingo_bin, encoding, fpath, timeout, consts)
+    elif backend == "clingo_api":
+        return solve_with_clingo_api(encoding, fpath, timeout, consts=consts)
+    elif backend == "numpy":
+        if encoding != ENCODINGS["original"] or consts:
+            raise ValueError("the numpy backend only implements tg_reasoner.lp without constants")
+        return solve_file(fpath)
+    raise ValueError(f"backend must be one of {BACKENDS}, not {backend}")
+
+def list_instances(instance_dirs):
+    """(file name, path) of every instance file, in the order results are reported"""
+    instances = []
+    for inst_dir in instance_dirs:
+        for fname in sorted(os.listdir(inst_dir)):
+            if fname.endswith(".lp"):
+                instances.append((fname, os.path.join(inst_dir, fname)))
+    return instances
+
+def count_events(fpath):
+    """cost estimate of an instance: the number of event/7 facts it contains"""
+    with open(fpath) as f:
+        return f.read().count("event(")
+
+def instance_timeout(n_events, timeout):
+    """per-instance timeout growing with the number of event pairs, capped at timeout"""
+    return min(timeout, MIN_TIMEOUT + SECONDS_PER_EVENT_PAIR * n_events ** 2)
+
+def run_instance(clingo_bin, encoding, fpath, timeout, backend="clingo", consts=None):
+    """solve one instance, reporting timeouts and errors in the result instead of raising"""
+    try:
+        return solve_instance(clingo_bin, encoding, fpath, timeout, backend, consts)
+    except TimeoutExpired:
+        return {"TIMEOUT": True}
+    except Exception as e:
+        return {"ERROR": str(e)}
+
+class _StoryScope(Transformer):
+    """
+    adds a story argument in front of the arguments of every atom, so the rules of an encoding
+    only combine atoms of the same story (ShowSignatures grow by one in arity accordingly)
+    """
+
+    def __init__(self, story_term):
+        self.story_term = story_term
 
-    # write to JSON file
-    with open(out_json, "w") as f:
-        json.dump(results, f, indent=2)
+    def visit_SymbolicAtom(self, atom):
+        symbol = atom.symbol
+        if symbol.ast_type == ASTType.Function:
+            return atom.update(symbol=symbol.update(arguments=[self.story_term, *symbol.arguments]))
+        return atom
+
+    def visit_ShowSignature(self, signature):
+        return signature.update(arity=signature.arity + 1)
+
+def scoped_encoding(encoding):
+    """
+    story-scoped variant of an encoding (cached per process): every atom takes the story as first argument
+    and every rule only applies to stories declared by story_scope/1, which keeps rules with aggregates safe
+    """
+    if encoding not in _scoped_encodings:
+        position = Position("<story_scope>", 0, 0)
+        location = Location(position, position)
+        story = Variable(location, "STORY")
+        domain = Literal(location, Sign.NoSign, SymbolicAtom(Function(location, STORY_SCOPE, [story], False)))
+        scope = _StoryScope(story)
+
+        statements = []
+        for statement in load_encoding(encoding):
+            statement = scope(statement)
+            if statement.ast_type == ASTType.Rule:
+                statement = statement.update(body=[*statement.body, domain])
+            statements.append(statement)
+        _scoped_encodings[encoding] = statements
+    return _scoped_encodings[encoding]
+
+def scoped_facts(fpath, story_id):
+    """the facts of an instance file with story_id as first argument, plus story_scope(story_id)"""
+    position = Position(fpath, 0, 0)
+    location = Location(position, position)
+    story = SymbolicTerm(location, clingo.Number(story_id))
+    scope = _StoryScope(story)
+
+    statements = []
+    parse_files([fpath], lambda statement: statements.append(scope(statement)))
+    declaration = f"{STORY_SCOPE}({story_id})."
+    return statements, declaration
+
+def split_story_atoms(symbols):
+    """group story-scoped atoms by story id, dropping the story argument (clingo's text form per predicate)"""
+    stories = {}
+    for symbol in symbols:
+        if symbol.name == STORY_SCOPE:
+            continue
+        atom = clingo.Function(symbol.name, symbol.arguments[1:], symbol.positive)
+        stories.setdefault(symbol.arguments[0].number, []).append(str(atom))
+    return {story_id: group_atoms(atoms) for story_id, atoms in stories.items()}
+
+def solve_scoped_in_process(encoding, facts, timeout, consts, name):
+    """ground and solve story-scoped facts (see scoped_facts) in this process, grouping the atoms by story id"""
+    started = time.monotonic()
+    messages = []
+    ctl = clingo.Control(["--warn=none"] + const_options(consts), logger=lambda code, msg: messages.append(msg))
+    try:
+        with ProgramBuilder(ctl) as builder:
+            for statement in scoped_encoding(encoding):
+                builder.add(statement)
+            for statements, _ in facts:
+                for statement in statements:
+                    builder.add(statement)
+        ctl.add("base", [], "\n".join(declaration for _, declaration in facts))
+        ctl.ground([("base", [])])
+    except RuntimeError as e:
+        raise RuntimeError(f"Clingo error: {''.join(messages) or e}")
+
+    symbols = []
+    remaining = timeout - (time.monotonic() - started)
+    with ctl.solve(on_model=lambda model: symbols.extend(model.symbols(shown=True)), async_=True) as handle:
+        if remaining <= 0 or not handle.wait(remaining):
+            handle.cancel()
+            raise TimeoutExpired(name, timeout)
+        result = handle.get()
+    if result.unsatisfiable:
+        raise RuntimeError("batch is unsatisfiable")
+    return split_story_atoms(symbols)
+
+def solve_batch(clingo_bin, encoding, fpaths, timeout, backend="clingo_api", consts=None):
+    """
+    solve several instances in one grounding and solving call
+
+    Return:
+        One result per instance, shaped like solve_instance's; raises like solve_instance if the batch
+        as a whole fails, and RuntimeError if it is unsatisfiable (which does not tell which story is)
+    """
+    facts = [scoped_facts(fpath, story_id) for story_id, fpath in enumerate(fpaths)]
+
+    if backend == "clingo_api":
+        # grounding and solving run in a forked child that is killed at the timeout, as in solve_with_clingo_api
+        scoped_encoding(encoding)
+        by_story = call_in_child(solve_scoped_in_process, (encoding, facts, timeout, consts, fpaths), timeout, fpaths)
+
+    elif backend == "clingo":
+        # the subprocess reads the story-scoped program from a temporary file
+        with tempfile.NamedTemporaryFile("w", suffix=".lp") as program:
+            for statement in scoped_encoding(encoding):
+                program.write(f"{statement}\n")
+            for statements, declaration in facts:
+                program.writelines(f"{statement}\n" for statement in statements)
+                program.write(f"{declaration}\n")
+            program.flush()
+            data = call_clingo(clingo_bin, [program.name], timeout, consts)
+        if data["Result"] == "UNSATISFIABLE":
+            raise RuntimeError("batch is unsatisfiable")
+        by_story = split_story_atoms(clingo.parse_term(atom) for call in data["Call"]
+                                     for witness in call.get("Witnesses", []) for atom in witness.get("Value", []))
+
+    else:
+        raise ValueError(f"batched solving needs a clingo backend, not {backend}")
+
+    return [by_story.get(story_id, {}) for story_id in range(len(fpaths))]
+
+def plan_batches(instances, costs, max_pairs=BATCH_EVENT_PAIRS, max_stories=BATCH_MAX_STORIES):
+    """
+    group (file name, path) pairs into batches of consecutive instances, adapting the batch size to
+    the instances' event counts: a batch is closed before its event pairs would exceed max_pairs
+    """
+    batches, batch, pairs = [], [], 0
+    for fname, fpath in instances:
+        cost = costs[fpath] ** 2
+        if batch and (pairs + cost > max_pairs or len(batch) >= max_stories):
+            batches.append(batch)
+            batch, pairs = [], 0
+        batch.append((fname, fpath))
+        pairs += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+def run_batch(clingo_bin, encoding, batch, timeout, backend="clingo_api", consts=None, timeouts=None):
+    """
+    solve a batch of (file name, path) pairs, falling back to solving its instances one by one
+    if the batch times out or clingo fails on it, e.g. because one instance is unsatisfiable
+    (so one instance cannot spoil the results of the others); other exceptions are raised
+
+    Return:
+        A list of (file name, result) pairs
+    """
+    if len(batch) > 1:
+        try:
+            results = solve_batch(clingo_bin, encoding, [fpath for _, fpath in batch], timeout, backend, consts)
+            return [(fname, result) for (fname, _), result in zip(batch, results)]
+        except TimeoutExpired:
+            print(f"Batch of {len(batch)} instances ({batch[0][0]} ...) timed out after {timeout}s, "
+                  f"solving its instances one by one")
+        except RuntimeError as e:
+            print(f"Batch of {len(batch)} instances ({batch[0][0]} ...) failed, solving its instances one by one: {e}")
+    return [(fname, run_instance(clingo_bin, encoding, fpath, timeouts[fpath] if timeouts else timeout,
+                                 backend, consts))
+            for fname, fpath in batch]
+
+def index_stream(stream_path):
+    """
+    byte offset of the latest record per instance file in a JSONL result stream
+
+    a trailing line without newline (left behind by an interrupted run) is not indexed
+    """
+    index = {}
+    if not os.path.exists(stream_path):
+        return index
+    with open(stream_path, "rb") as f:
+        offset = 0
+        for line in f:
+            if line.endswith(b"\n"):
+                index[json.loads(line)["file"]] = offset
+            offset += len(line)
+    return index
+
+def solved_instances(stream_path):
+    """
+    instance files whose latest record in a JSONL result stream is an answer set (or UNSAT);
+    timeouts and errors depend on the time budget and the machine, so resume solves them again
+    """
+    index = index_stream(stream_path)
+    solved = set()
+    if not index:
+        return solved
+    with open(stream_path, "rb") as f:
+        for fname, offset in index.items():
+            f.seek(offset)
+            result = json.loads(f.readline())["result"]
+            if "TIMEOUT" not in result and "ERROR" not in result:
+                solved.add(fname)
+    return solved
+
+def repair_stream(stream_path):
+    """cut off a partially written last record so new records can be appended safely"""
+    if not os.path.exists(stream_path):
+        return
+    with open(stream_path, "rb+") as f:
+        content = f.read()
+        if content and not content.endswith(b"\n"):
+            f.truncate(content.rfind(b"\n") + 1)
+
+def compact_results(stream_path, out_json, order=None):
+    """
+    write the records of a JSONL result stream as the legacy asp_results.json dictionary
+
+    records are read one at a time, so memory does not grow with the total size of the answer sets;
+    order lists the instance files to include (default: all, in stream order)
+
+    Return:
+        The number of instances written
+    """
+    index = index_stream(stream_path)
+    keys = [key for key in (order if order is not None else index) if key in index]
+
+    # same bytes as json.dump(results, f, indent=2) on the full dictionary
+    with open(stream_path, "rb") as src, open(out_json, "w") as f:
+        f.write("{")
+        for i, key in enumerate(keys):
+            src.seek(index[key])
+            result = json.loads(src.readline())["result"]
+            f.write(",\n  " if i else "\n  ")
+            f.write(json.dumps(key) + ": " + json.dumps(result, indent=2).replace("\n", "\n  "))
+        f.write("\n}" if keys else "}")
+
+    return len(keys)
+
+def run_instances(clingo_bin, encoding, instance_dirs, timeout=30, out_json="results.json", backend="clingo",
+                  workers=1, adaptive_timeout=False, stream_path=None, resume=False, consts=None, batch=False,
+                  cache=True):
+    """
+    solve all instances in instance_dirs and write the answer sets to out_json
+
+    Args:
+        encoding (str) path of an encoding, or a key of ENCODINGS ("original", "scalable")
+        workers (int) number of worker processes; with more than one, instances are scheduled
+            longest-first (by event count) on a process pool
+        adaptive_timeout (bool) derive each instance's timeout from its event count (see instance_timeout),
+            with timeout as the upper bound, instead of using timeout for every instance
+        stream_path (str) JSONL file each result is appended to as soon as it is solved
+            (default: out_json with a .jsonl extension); out_json is compacted from it at the end
+        resume (bool) keep the existing stream and skip instances already solved in it
+            (instances recorded with a timeout or error are solved again)
+        consts (dict) clingo constants, e.g. {"pair_window": 3, "pair_scope": "subject"} for the scalable encoding
+        batch (bool) solve consecutive small instances together in one clingo call (see plan_batches),
+            with a story-scoped encoding; needs the clingo or clingo_api backend
+        cache (bool or ReasoningCache) look up answer sets by encoding, instance facts and solver options
+            before solving and store new ones (True: the default cache in .cache/, False: solve everything);
+            instances with identical facts are solved once per run either way
+    """
+    encoding = ENCODINGS.get(encoding, encoding)
+    if stream_path is None:
+        stream_path = os.path.splitext(out_json)[0] + ".jsonl"
+
+    instances = list_instances(instance_dirs)
+    if resume:
+        repair_stream(stream_path)
+        recorded = index_stream(stream_path)
+        done = solved_instances(stream_path)
+        pending = [(fname, fpath) for fname, fpath in instances if fname not in done]
+        retried = sum(1 for fname, _ in pending if fname in recorded)
+        print(f"Resuming: {len(instances) - len(pending)} instances already in {stream_path}, "
+              f"{retried} timeouts and errors solved again")
+    else:
+        pending = instances
+
+    # answer sets found in the cache are recorded without solving; of the remaining instances,
+    # only the first of each group with identical facts is solved and its result copied to the others
+    own_cache = cache is True
+    if own_cache:
+        cache = ReasoningCache()
+    keys, copies, cached = {}, {}, []
+    encoding_hash = encoding_digest(encoding)
+    unsolved = []
+    for fname, fpath in pending:
+        try:
+            key = result_key(encoding_hash, facts_digest(fpath), backend, consts)
+        except RuntimeError:
+            # unparsable instance: solving reports the error
+            unsolved.append((fname, fpath))
+            continue
+        if key in copies:
+            copies[key].append(fname)
+            continue
+        result = cache.get(key) if cache else None
+        if result is not None:
+            cached.append((fname, result))
+            continue
+        keys[fname] = key
+        copies[key] = []
+        unsolved.append((fname, fpath))
+    n_copies = sum(len(fnames) for fnames in copies.values())
+    pending = unsolved
+
+    costs = {fpath: count_events(fpath) for _, fpath in pending}
+    timeouts = {fpath: instance_timeout(costs[fpath], timeout) if adaptive_timeout else timeout
+                for _, fpath in pending}
+
+    with open(stream_path, "a" if resume else "w") as stream:
+        def record(fname, result):
+            key = keys.get(fname)
+            for name in [fname] + copies.get(key, []):
+                stream.write(json.dumps({"file": name, "result": result}) + "\n")
+            stream.flush()
+            if cache and key is not None:
+                cache.put(key, result)
+
+        for fname, result in cached:
+            record(fname, result)
+
+        if batch:
+            batches = plan_batches(pending, costs)
+            batch_timeouts = [min(timeout, sum(timeouts[fpath] for _, fpath in b)) for b in batches]
+            print(f"Solving {len(pending)} instances in {len(batches)} batches")
+            if workers > 1:
+                # most expensive batches first, as for single instances below
+                order = sorted(range(len(batches)), key=lambda i: sum(costs[fpath] ** 2 for _, fpath in batches[i]),
+                               reverse=True)
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    futures = [pool.submit(run_batch, clingo_bin, encoding, batches[i], batch_timeouts[i], backend,
+                                           consts, timeouts) for i in order]
+                    for future in as_completed(futures):
+                        for fname, result in future.result():
+                            record(fname, result)
+            else:
+                for b, batch_timeout in zip(batches, batch_timeouts):
+                    for fname, result in run_batch(clingo_bin, encoding, b, batch_timeout, backend, consts, timeouts):
+                        record(fname, result)
+        elif workers > 1:
+            # start the most expensive instances first so a slow story does not stretch the makespan at the end
+            schedule = sorted(pending, key=lambda inst: costs[inst[1]], reverse=True)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(run_instance, clingo_bin, encoding, fpath, timeouts[fpath], backend, consts): fname
+                           for fname, fpath in schedule}
+                for future in as_completed(futures):
+                    record(futures[future], future.result())
+        else:
+            for fname, fpath in pending:
+                record(fname, run_instance(clingo_bin, encoding, fpath, timeouts[fpath], backend, consts))
+
+    # report in listing order, independent of completion order
+    compact_results(stream_path, out_json, order=[fname for fname, _ in instances])
 
     print(f"Results written to {out_json}")
+    if cache:
+        stats = cache.stats()
+        print(f"Reasoning cache: {len(cached)} hits, {len(keys)} misses, {n_copies} instances sharing "
+              f"the facts of another ({stats['entries']} entries, {stats['bytes'] / 1024 ** 2:.1f} MB)")
+        if own_cache:
+            cache.close()
+    else:
+        print(f"{n_copies} instances shared the facts of another and were not solved again")
+
+def check_parity(clingo_bin, encoding, instance_dirs, timeout=30, backend="numpy"):
+    """
+    compare the atoms derived by an alternative backend against clingo on every instance
+
+    Return:
+        A dictionary mapping each instance file with differing output to the predicates that differ
+    """
+    encoding = ENCODINGS.get(encoding, encoding)
+    mismatches = {}
+
+    for fname, fpath in list_instances(instance_dirs):
+        expected = solve_with_clingo(clingo_bin, encoding, fpath, timeout)
+        actual = solve_instance(clingo_bin, encoding, fpath, timeout, backend)
+
+        # atom order within a predicate depends on the backend, so compare as sets
+        diff = [pred for pred in sorted(set(expected) | set(actual))
+                if set(expected.get(pred, [])) != set(actual.get(pred, []))]
+        if diff:
+            mismatches[fname] = diff
+
+    print(f"{len(mismatches)} instances differ between clingo and {backend}")
+    return mismatches
+
+def check_encoding_agreement(clingo_bin, instance_dirs, encoding="scalable", consts=None, timeout=30,
+                             backend="clingo_api"):
+    """
+    compare an alternative encoding against tg_reasoner.lp on every instance
+
+    all predicates must be identical, except that with caps set in consts the pairwise predicates
+    only need to be a subset of the original's
+
+    Return:
+        A dictionary mapping each instance file with differing output to the predicates that differ
+    """
+    encoding = ENCODINGS.get(encoding, encoding)
+    capped = bool(consts) and any(value not in (0, "0", "all") for value in consts.values())
+    mismatches = {}
+
+    for fname, fpath in list_instances(instance_dirs):
+        expected = solve_instance(clingo_bin, ENCODINGS["original"], fpath, timeout, backend)
+        actual = solve_instance(clingo_bin, encoding, fpath, timeout, backend, consts)
+
+        diff = []
+        for pred in sorted(set(expected) | set(actual)):
+            expected_atoms, actual_atoms = set(expected.get(pred, [])), set(actual.get(pred, []))
+            if capped and pred in PAIRWISE_PREDICATES:
+                if not actual_atoms <= expected_atoms:
+                    diff.append(pred)
+            elif actual_atoms != expected_atoms:
+                diff.append(pred)
+        if diff:
+            mismatches[fname] = diff
+
+    print(f"{len(mismatches)} instances differ between {ENCODINGS['original']} and {encoding}")
+    return mismatches
 
 if __name__ == "__main__":
-    
-    encoding = "src/tg_reasoner.lp"
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--resume", action="store_true",
+                            help="skip instances already recorded in results/asp_results.jsonl")
+    arg_parser.add_argument("--encoding", choices=list(ENCODINGS), default="original")
+    arg_parser.add_argument("--pair-window", type=int, default=0,
+                            help="scalable encoding: relate each event to the next N events in start order (0: no cap)")
+    arg_parser.add_argument("--pair-scope", choices=["all", "subject"], default="all",
+                            help="scalable encoding: relate all events or only events sharing their subject")
+    arg_parser.add_argument("--batch", action="store_true",
+                            help="solve small instances together in batched clingo calls")
+    arg_parser.add_argument("--no-cache", action="store_true",
+                            help="solve every instance instead of reusing answer sets from .cache/answer_sets.sqlite")
+    arg_parser.add_argument("--adaptive-timeout", action="store_true",
+                            help="give each instance MIN_TIMEOUT plus SECONDS_PER_EVENT_PAIR per event pair "
+                                 "(at most 1000 s) instead of a flat 1000 s")
+    arg_parser.add_argument("--check-parity", choices=[backend for backend in BACKENDS if backend != "clingo"],
+                            help="compare the given backend against the clingo subprocess on the bundled instances "
+                                 "instead of writing results")
+    arg_parser.add_argument("--check-encoding", action="store_true",
+                            help="compare the scalable encoding against the original on the bundled instances, "
+                                 "uncapped and with the caps in AGREEMENT_CONSTS, instead of writing results")
+    args = arg_parser.parse_args()
+
     instance_dirs = ["ASPinstances/TGQA", "ASPinstances/TimeQA"]
-    run_instances("clingo", encoding, instance_dirs, timeout=1000, out_json="results/asp_results.json")
\ No newline at end of file
+    if args.check_parity:
+        mismatches = check_parity("clingo", "original", instance_dirs, backend=args.check_parity)
+        for fname, preds in mismatches.items():
+            print(f"  {fname}: {', '.join(preds)}")
+        raise SystemExit(1 if mismatches else 0)
+
+    if args.check_encoding:
+        failed = False
+        for consts in AGREEMENT_CONSTS:
+            print(f"pair_window={consts['pair_window']}, pair_scope={consts['pair_scope']}:")
+            mismatches = check_encoding_agreement("clingo", instance_dirs, "scalable", consts)
+            for fname, preds in mismatches.items():
+                print(f"  {fname}: {', '.join(preds)}")
+            failed = failed or bool(mismatches)
+        raise SystemExit(1 if failed else 0)
+
+    consts = None
+    if args.encoding == "scalable":
+        consts = {"pair_window": args.pair_window, "pair_scope": args.pair_scope}
+    run_instances("clingo", args.encoding, instance_dirs, timeout=1000, out_json="results/asp_results.json",
+                  workers=os.cpu_count(), adaptive_timeout=args.adaptive_timeout, resume=args.resume, consts=consts,
+                  batch=args.batch, cache=not args.no_cache)
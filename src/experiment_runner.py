@@ -0,0 +1,314 @@
+# one runner for the prompt strategies of the LLM modules: ASP-augmented, story-only and TG-only
+# all strategies run over the same sample with one shared client; results are appended per instance
+# to a JSONL stream next to each results file, so an interrupted run resumes with the questions not yet answered
+# (only with the configuration it was started with, which the first line of each stream records)
+
+import os
+import glob
+import json
+import asyncio
+import hashlib
+from dataset_snapshot import load_split, sample_random_rows, sample_stratified_rows
+from async_runner import run_batch_async, RateLimiter
+from llm_client import shared_client, shared_async_client
+from tracing import tracer, summarize_trace
+import llm_module
+import llm_only_module
+import llm_tg_only_module
+
+RESULTS_DIR = "results"
+PROMPTS_DIR = "src/prompts"
+
+
+def prompt_templates_digest(prompts_dir=PROMPTS_DIR) -> str:
+    """sha256 over the names and contents of the prompt templates"""
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(prompts_dir, "*.txt"))):
+        digest.update(os.path.basename(path).encode() + b"\0")
+        with open(path, "rb") as f:
+            digest.update(f.read() + b"\0")
+    return digest.hexdigest()
+
+
+class Strategy:
+    """
+    a way of prompting the LLM, answering one instance per unit of work with run_fn(instance, client=...)
+    """
+
+    def __init__(self, name, run_fn, label, output_name, model):
+        self.name = name
+        self.run_fn = run_fn
+        self.label = label
+        self.output_name = output_name
+        self.model = model
+
+    def output_path(self, data, results_dir=RESULTS_DIR):
+        return os.path.join(results_dir, self.output_name.format(model=self.model, data=data))
+
+    def units(self, subset):
+        """units of work over the sample: {"id": ..., "instances": [...]}"""
+        return [{"id": instance["id"], "instances": [instance]} for instance in subset]
+
+    def run(self, unit, client=None):
+        """results of a unit's instances, by instance id"""
+        instance = unit["instances"][0]
+        return {instance["id"]: self.run_fn(instance, client=client)}
+
+    def config(self) -> dict:
+        """everything a result of this strategy depends on besides the instance"""
+        return {"strategy": self.name, "model": self.model, "prompts": prompt_templates_digest()}
+
+    def summarize(self, results):
+        pass
+
+
+class AspAugmented(Strategy):
+    """
+    llm_module's two-stage pipeline, optionally with several questions of a story per stage 2 request,
+    run with the given pipeline options (see llm_module.pipeline_options)
+    """
+
+    def __init__(self, questions_per_request=1, options=None):
+        super().__init__("asp", llm_module.run_instance, "[ASP] ", "llm_results_{model}_{data}.json", llm_module.MODEL)
+        self.questions_per_request = questions_per_request
+        self.options = options or llm_module.pipeline_options()
+
+    def units(self, subset):
+        if self.questions_per_request > 1:
+            return llm_module.group_by_story(subset)
+        return super().units(subset)
+
+    def run(self, unit, client=None):
+        if self.questions_per_request > 1:
+            results = llm_module.run_story(unit, client=client, questions_per_request=self.questions_per_request,
+                                           options=self.options)
+            return {instance["id"]: result for instance, result in zip(unit["instances"], results)}
+        instance = unit["instances"][0]
+        return {instance["id"]: self.run_fn(instance, client=client, options=self.options)}
+
+    def config(self) -> dict:
+        return {**super().config(), "pipeline_options": self.options,
+                "questions_per_request": self.questions_per_request}
+
+    def summarize(self, results):
+        fast = sum(1 for res in results.values() if res.get("answer_source") == "fast_path")
+        print(f"Fast path answered {fast}/{len(results)} instances without LLM calls")
+
+        saved = [res["compaction"]["tokens_saved"] for res in results.values() if res.get("compaction")]
+        if saved:
+            print(f"Prompt compaction saved {sum(saved)} tokens ({sum(saved) / len(saved):.0f} per instance)")
+
+
+STRATEGY_NAMES = ["asp", "story_only", "tg_only"]
+
+
+def make_strategy(name, questions_per_request=1, options=None) -> Strategy:
+    if name == "asp":
+        return AspAugmented(questions_per_request, options)
+    if name == "story_only":
+        return Strategy("story_only", llm_only_module.run_instance_story_only, "[Story-only] ",
+                        "llm_results_story_only_{model}_{data}.json", llm_only_module.MODEL)
+    if name == "tg_only":
+        return Strategy("tg_only", llm_tg_only_module.run_instance_tg_only, "[TG-only] ",
+                        "llm_results_tg_only_{model}_{data}.json", llm_tg_only_module.MODEL)
+    raise ValueError(f"strategy must be one of {STRATEGY_NAMES}, not {name}")
+
+
+# -----------------------------
+# Sampling
+# -----------------------------
+
+def sample_subset(data, n=50, mode="random", seed=42) -> list:
+    """sample instances of a dataset's test split by row index, so only the selected rows are read"""
+    dataset, index = load_split(data, "test" if data == "TGQA_TGR" else "hard_test")
+    if mode == "random":
+        rows = sample_random_rows(len(dataset), n, seed)
+    elif mode == "stratified":
+        # Q-Type buckets come from the snapshot index (see dataset_snapshot.build_index)
+        rows = sample_stratified_rows(index["qtypes"], n, seed)
+    else:
+        raise ValueError("mode must be 'random' or 'stratified'")
+    return [dataset[row] for row in rows]
+
+
+# -----------------------------
+# Result streams
+# -----------------------------
+
+def stream_path(output_path) -> str:
+    return os.path.splitext(output_path)[0] + ".jsonl"
+
+
+def config_hash(config: dict) -> str:
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def read_header(path):
+    """the header record of a result stream, or None if it has none (or does not exist)"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        line = f.readline()
+    if not line.endswith("\n"):
+        return None
+    record = json.loads(line)
+    return record.get("header")
+
+
+def read_stream(path) -> dict:
+    """latest result per instance id in a result stream (the header and a truncated last line are ignored)"""
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path) as f:
+        for line in f:
+            if line.endswith("\n"):
+                record = json.loads(line)
+                if "header" not in record:
+                    results[record["id"]] = record["result"]
+    return results
+
+
+def compact_stream(path, output_path, subset) -> dict:
+    """write the results of the sample's instances in sample order, as the modules' run_batch functions did"""
+    streamed = read_stream(path)
+    results = {instance["id"]: streamed[instance["id"]] for instance in subset if instance["id"] in streamed}
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp_path, output_path)
+    return results
+
+
+class ResultStream:
+    """
+    appends results to a strategy's stream as they arrive, after a header record with the strategy's config;
+    when resuming, instances already answered count as done, provided the stream was written with the same config
+    """
+
+    def __init__(self, path, config, resume=False):
+        header = {"config": config, "hash": config_hash(config)}
+        resume = resume and os.path.exists(path) and os.path.getsize(path) > 0
+        if resume:
+            recorded = read_header(path)
+            if recorded is None or recorded["hash"] != header["hash"]:
+                raise ValueError(f"{path} was written with a different configuration "
+                                 f"({'none recorded' if recorded is None else recorded['config']}, now {config}); "
+                                 "run with resume=False to start it over")
+            # only answered instances are done: errors are retried on resume
+            self.done = {instance_id for instance_id, result in read_stream(path).items() if "error" not in result}
+        else:
+            self.done = set()
+        self.file = open(path, "a" if resume else "w")
+        if not resume:
+            self.file.write(json.dumps({"header": header}) + "\n")
+            self.file.flush()
+
+    def write(self, unit, output):
+        if "error" in output and len(output) == 1:
+            # the whole unit failed
+            output = {instance["id"]: output for instance in unit["instances"]}
+        for instance_id, result in output.items():
+            self.file.write(json.dumps({"id": instance_id, "result": result}) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# -----------------------------
+# Runner
+# -----------------------------
+
+async def _run_concurrently(work, concurrency, rpm, tpm):
+    """run all strategies on one event loop, sharing the async client and the rate limits"""
+    limiter = RateLimiter(rpm, tpm)
+    client = shared_async_client()
+    cache = shared_client().cache
+    await asyncio.gather(*(
+        run_batch_async(units, strategy.run, client=client, concurrency=concurrency, label=strategy.label,
+                        cache=cache, limiter=limiter, on_result=stream.write)
+        for strategy, units, stream in work))
+
+
+def run_experiment(strategies=("asp",), n=50, mode="random", data=llm_module.DATA, seed=42, output_paths=None,
+                   results_dir=RESULTS_DIR, concurrency=1, rpm=None, tpm=None, trace_path=None, resume=False,
+                   questions_per_request=1, use_router=llm_module.USE_ROUTER, use_fast_path=llm_module.USE_FAST_PATH,
+                   compact_prompts=llm_module.COMPACT_PROMPTS, asp_source=llm_module.ASP_SOURCE):
+    """
+    answer the same sample with several prompt strategies
+
+    Args:
+        strategies (list) names from STRATEGY_NAMES
+        output_paths (dict) results file per strategy name (default: the modules' file names in results_dir);
+            results are streamed to the same path with a .jsonl extension while the run is going
+        concurrency (int) instances in flight per strategy; with more than 1 the strategies also run
+            concurrently, within one shared rpm/tpm budget
+        trace_path (str) write per-stage spans to this JSONL file and print a summary at the end
+        resume (bool) skip instances already answered in the streams (default: start the streams over);
+            a stream is only resumed if it was written with the same model, prompt templates and options
+        questions_per_request (int) stage 2 questions per request of the ASP strategy (see llm_module.run_story)
+        use_router, use_fast_path, compact_prompts (bool) options of the ASP strategy (see llm_module.pipeline_options),
+            all off by default so results stay comparable with the stored baseline; recorded in every result
+        asp_source (str) where the ASP strategy takes stage 2 facts from (see llm_module.ASP_SOURCES); the
+            precomputed results are only opened if the ASP strategy runs
+
+    Return:
+        A dictionary mapping strategy names to their results
+    """
+    subset = sample_subset(data, n, mode, seed)
+    output_paths = output_paths or {}
+    options = llm_module.pipeline_options(use_router=use_router, use_fast_path=use_fast_path,
+                                          compact_prompts=compact_prompts, asp_source=asp_source)
+
+    work = []
+    for name in strategies:
+        strategy = make_strategy(name, questions_per_request, options)
+        output_path = output_paths.get(name) or strategy.output_path(data, results_dir)
+        stream = ResultStream(stream_path(output_path), strategy.config(), resume)
+        units = [unit for unit in strategy.units(subset)
+                 if not all(instance["id"] in stream.done for instance in unit["instances"])]
+        print(f"{strategy.label}{len(subset) - sum(len(unit['instances']) for unit in units)} "
+              f"of {len(subset)} instances already answered")
+        work.append((strategy, units, stream, output_path))
+
+    if trace_path:
+        tracer.start(trace_path, append=resume)
+
+    try:
+        if concurrency > 1:
+            asyncio.run(_run_concurrently([(strategy, units, stream) for strategy, units, stream, _ in work],
+                                          concurrency, rpm, tpm))
+        else:
+            for strategy, units, stream, _ in work:
+                for i, unit in enumerate(units):
+                    print(f"{strategy.label}Processing {unit['id']} ({i+1}/{len(units)})...")
+                    try:
+                        output = strategy.run(unit)
+                    except Exception as e:
+                        output = {"error": str(e)}
+                    stream.write(unit, output)
+    finally:
+        for _, _, stream, _ in work:
+            stream.close()
+        if trace_path:
+            tracer.stop()
+
+    all_results = {}
+    for strategy, _, stream, output_path in work:
+        results = compact_stream(stream_path(output_path), output_path, subset)
+        print(f"{strategy.label}Saved results for {len(results)} instances to {output_path}")
+        strategy.summarize(results)
+        all_results[strategy.name] = results
+
+    stats = shared_client().cache.stats()
+    print(f"Completion cache: {stats['hits']} hits, {stats['misses']} misses")
+
+    if trace_path:
+        summarize_trace(trace_path)
+    return all_results
+
+
+if __name__ == "__main__":
+    # all three strategies over the same stratified sample
+    run_experiment(STRATEGY_NAMES, n=500, mode="stratified")
@@ -0,0 +1,281 @@
+# symbolic fast path: answer questions that the event times of a story determine, without calling the LLM
+# a question is answered only if exactly one candidate is consistent with the story's TG, otherwise it is left to the LLM
+
+import os
+import re
+import json
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from utils import MONTHS
+
+# TGQA TG entry, e.g. "(John Lennon was born in Cambridge) starts at 1940"
+TGQA_ENTRY = re.compile(r"^\((.+)\) (starts|ends) at (-?\d+)$")
+# TimeQA TG entry, e.g. "Nov 1935 - Sep 1937 : VP-29's official name is ( Patrol Squadron 14-F )"
+TIMEQA_ENTRY = re.compile(r"^(.+?)(?:\s+-\s+(.+?))?\s+:\s+(.+)$")
+# TimeQA date ("Nov 1935" or "1935"), as in symbolic_module.DATE_PATTERN
+DATE = r"(?:[A-Za-z]+\s+)?[1-9]\d{3}"
+
+DURATION = re.compile(r"^(\d+) years?$")
+ORDINALS = {name: n for n, name in enumerate(
+    ["first", "second", "third", "fourth", "fifth", "sixth", "seventh", "eighth", "ninth", "tenth"], start=1)}
+
+# question templates, named as in predicate_router.TEMPLATES; groups capture the events or dates of the question
+QUESTIONS = [
+    ("start", r"^When did the event \((.+)\) start\?$"),
+    ("duration", r"^How long did the event \((.+)\) last\?$"),
+    ("same_year", r"^True or false: event \((.+)\) and event \((.+)\) started at the same year\?$"),
+    ("time_passed", r"^How much time passed between the start of event \((.+)\) and the start of event \((.+)\)\?$"),
+    ("started_first", r"^Which event started first, \((.+)\) or \((.+)\)\?$"),
+    ("longer", r"^True or false: event \((.+)\) was longer in duration than event \((.+)\)\?$"),
+    ("still_happening", r"^True or false: event \((.+)\) was still happening when event \((.+)\) started\?$"),
+    ("neighbour", r"^What happened right (before|after) the event \((.+)\) (starts|ends)\?$"),
+    ("nth_event", r"^Given the following .+ events: .+ Which event is the (\w+) one in chronological order\?$"),
+    # TimeQA questions about a point or span of time
+    ("in_period", rf"^.+ (?:in|on|during) ({DATE})\?$"),
+    ("between", rf"^.+ between ({DATE}) and ({DATE})\?$"),
+]
+COMPILED_QUESTIONS = [(name, re.compile(pattern, re.DOTALL)) for name, pattern in QUESTIONS]
+
+
+def parse_month(date: str, end=False) -> int:
+    """
+    months since year 0 of a TimeQA date; a date without a month covers the whole year,
+    so it is taken as January (end=False) or December (end=True)
+    """
+    parts = date.split()
+    year = int(parts[-1])
+    if len(parts) == 2:
+        month = MONTHS.get(parts[0].lower())
+        if month is None:
+            raise ValueError(f"unknown month in {date!r}")
+    else:
+        month = 12 if end else 1
+    return year * 12 + month - 1
+
+
+class EventIndex:
+    """
+    times of a story's events, from its TG
+
+    TGQA stories map each event text to its start and end year and keep all start and end points
+    sorted for neighbour queries; TimeQA stories keep their facts sorted by start month for
+    overlap queries (a fact whose start is past the query span cannot overlap it)
+    """
+
+    def __init__(self, TG):
+        if isinstance(TG, str):
+            TG = TG.split("\n")
+        self.starts, self.ends = {}, {}
+        self.spans = []
+        for entry in TG:
+            entry = entry.strip()
+            match = TGQA_ENTRY.match(entry)
+            if match:
+                event, start_or_end, year = match.groups()
+                (self.starts if start_or_end == "starts" else self.ends)[event] = int(year)
+                continue
+            match = TIMEQA_ENTRY.match(entry)
+            if match:
+                first, last, fact = match.groups()
+                try:
+                    self.spans.append((parse_month(first), parse_month(last or first, end=True), fact))
+                except ValueError:
+                    continue
+
+        # (time, "starts" or "ends", event) of every TGQA point, sorted by time
+        self.points = sorted([(year, "starts", event) for event, year in self.starts.items()]
+                             + [(year, "ends", event) for event, year in self.ends.items()])
+        self.point_times = [time for time, _, _ in self.points]
+        self.spans.sort(key=lambda span: span[0])
+        self.span_starts = [first for first, _, _ in self.spans]
+
+    def start(self, event):
+        return self.starts.get(event)
+
+    def end(self, event):
+        """end year of an event; an event without an end is a point in time, as in symbolic_module.tg_to_asp"""
+        if event not in self.starts:
+            return None
+        return self.ends.get(event, self.starts[event])
+
+    def duration(self, event):
+        if event not in self.starts:
+            return None
+        return self.end(event) - self.start(event)
+
+    def point(self, reference):
+        """year of a candidate like "(X was born in Y) starts" (None if it is not in the TG)"""
+        match = re.match(r"^\((.+)\) (starts|ends)$", reference)
+        if match is None:
+            return None
+        event, start_or_end = match.groups()
+        return (self.starts if start_or_end == "starts" else self.ends).get(event)
+
+    def neighbour_time(self, time, direction):
+        """time of the closest point strictly before or after time (None if there is none)"""
+        if direction == "before":
+            i = bisect_left(self.point_times, time)
+            return self.point_times[i - 1] if i > 0 else None
+        i = bisect_right(self.point_times, time)
+        return self.point_times[i] if i < len(self.point_times) else None
+
+    def overlapping(self, first, last):
+        """TimeQA facts whose span overlaps the months first..last"""
+        stop = bisect_right(self.span_starts, last)
+        return [fact for start, end, fact in self.spans[:stop] if end >= first]
+
+
+# -----------------------------
+# Rules: consistent candidates per question template
+# -----------------------------
+
+def _truth(value, candidates):
+    return [c for c in candidates if c == str(value)]
+
+
+def _years(value, candidates):
+    return [c for c in candidates if DURATION.match(c) and int(DURATION.match(c).group(1)) == value]
+
+
+def consistent_candidates(rule, groups, candidates, index):
+    """
+    the candidates consistent with the story's events under a question template
+
+    Return:
+        A list of candidates, or None if the question refers to something the index does not know
+    """
+    if rule == "start":
+        year = index.start(groups[0])
+        return None if year is None else [c for c in candidates if c.strip() == str(year)]
+
+    if rule == "duration":
+        duration = index.duration(groups[0])
+        return None if duration is None else _years(duration, candidates)
+
+    if rule in ("same_year", "time_passed", "started_first", "longer", "still_happening"):
+        first, second = groups
+        if first not in index.starts or second not in index.starts:
+            return None
+        if rule == "same_year":
+            return _truth(index.start(first) == index.start(second), candidates)
+        if rule == "time_passed":
+            return _years(abs(index.start(second) - index.start(first)), candidates)
+        if rule == "started_first":
+            if index.start(first) == index.start(second):
+                return candidates
+            earlier = first if index.start(first) < index.start(second) else second
+            return [c for c in candidates if c == earlier]
+        if rule == "longer":
+            return _truth(index.duration(first) > index.duration(second), candidates)
+        # was the first event ongoing at the start of the second (as in tg_reasoner.lp's was_still_happening)
+        return _truth(index.start(first) <= index.start(second) <= index.end(first), candidates)
+
+    if rule == "neighbour":
+        direction, event, start_or_end = groups
+        time = (index.starts if start_or_end == "starts" else index.ends).get(event)
+        if time is None:
+            return None
+        target = index.neighbour_time(time, direction)
+        if target is None:
+            return None
+        return [c for c in candidates if index.point(c) == target]
+
+    if rule == "nth_event":
+        n = ORDINALS.get(groups[0].lower())
+        starts = [index.start(c) for c in candidates]
+        if n is None or n > len(candidates) or None in starts:
+            return None
+        nth = sorted(starts)[n - 1]
+        return [c for c, start in zip(candidates, starts) if start == nth]
+
+    if rule in ("in_period", "between"):
+        first = parse_month(groups[0])
+        last = parse_month(groups[-1], end=True)
+        facts = index.overlapping(first, last)
+        # facts with the object "( Unknown )" make the "Unknown" candidate consistent
+        return [c for c in candidates if any(f"( {c} )" in fact for fact in facts)]
+
+    raise ValueError(f"unknown fast path rule {rule}")
+
+
+def answer_question(question, candidates, TG):
+    """
+    answer a question from the event times in its TG, if they determine the answer
+
+    Return:
+        (answer, rule) if exactly one candidate is consistent, else (None, rule) (rule is None
+        for questions outside the templates)
+    """
+    question = question.strip()
+    for rule, pattern in COMPILED_QUESTIONS:
+        match = pattern.match(question)
+        if match:
+            break
+    else:
+        return None, None
+
+    try:
+        consistent = consistent_candidates(rule, match.groups(), list(candidates), EventIndex(TG))
+    except ValueError:
+        return None, rule
+    if consistent is None or len(consistent) != 1:
+        return None, rule
+    return consistent[0], rule
+
+
+# -----------------------------
+# Coverage and accuracy on stored results
+# -----------------------------
+
+def fast_path_report(results_dir="results"):
+    """
+    run the fast path on the questions of stored result files that include the TG (instance_TG)
+
+    coverage is the share of questions the fast path answers, accuracy the share of those it answers
+    correctly; llm_accuracy is the stored LLM answers' accuracy on the same questions
+
+    Return:
+        A dictionary with overall and per-rule coverage and accuracy
+    """
+    total = Counter()
+    answered = Counter()
+    correct = Counter()
+    llm_correct = Counter()
+
+    for fname in sorted(os.listdir(results_dir)):
+        if not fname.endswith(".json") or fname == "asp_results.json":
+            continue
+        with open(os.path.join(results_dir, fname)) as f:
+            results = json.load(f)
+
+        for res in results.values():
+            if "instance_TG" not in res:
+                continue
+            answer, rule = answer_question(res["instance_question"], res["instance_candidates"], res["instance_TG"])
+            rule = rule or "none"
+            total[rule] += 1
+            if answer is None:
+                continue
+            answered[rule] += 1
+            correct[rule] += answer in res["instance_gold_answer"]
+            llm_correct[rule] += bool(res.get("match"))
+
+    def stats(n, n_answered, n_correct, n_llm_correct):
+        return {"questions": n,
+                "coverage": n_answered / n if n else 0.0,
+                "accuracy": n_correct / n_answered if n_answered else 0.0,
+                "llm_accuracy": n_llm_correct / n_answered if n_answered else 0.0}
+
+    report = stats(sum(total.values()), sum(answered.values()), sum(correct.values()), sum(llm_correct.values()))
+    report["rules"] = {rule: stats(total[rule], answered[rule], correct[rule], llm_correct[rule]) for rule in total}
+
+    print(f"Fast path coverage: {sum(answered.values())}/{report['questions']} stored questions")
+    print(f"Fast path accuracy: {report['accuracy']*100:.1f}% (stored LLM answers: {report['llm_accuracy']*100:.1f}%)")
+    for rule, rule_stats in sorted(report["rules"].items()):
+        print(f"  {rule}: {rule_stats['questions']} questions, {rule_stats['coverage']*100:.1f}% answered, "
+              f"{rule_stats['accuracy']*100:.1f}% correct (LLM {rule_stats['llm_accuracy']*100:.1f}%)")
+    return report
+
+
+if __name__ == "__main__":
+    fast_path_report()
@@ -0,0 +1,28 @@
+# OpenAI clients shared by the LLM modules and the experiment runner
+# built on first use rather than at import, once per process: every strategy and worker thread
+# reuses the same client and with it one keep-alive connection pool
+
+import os
+import threading
+from openai import OpenAI, AsyncOpenAI
+from completion_cache import CompletionCache, cached_client
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def shared_client():
+    """synchronous client answering from the completion cache when possible (has .cache, see cached_client)"""
+    with _lock:
+        if "sync" not in _clients:
+            # completions are cached on disk, so re-runs with identical prompts do not call the API again
+            _clients["sync"] = cached_client(OpenAI(api_key=os.environ["OPENAI_API_KEY"]), CompletionCache())
+        return _clients["sync"]
+
+
+def shared_async_client():
+    """async client for async_runner (which retries itself, so the client does not)"""
+    with _lock:
+        if "async" not in _clients:
+            _clients["async"] = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"], max_retries=0)
+        return _clients["async"]
@@ -1,19 +1,57 @@
 import os
 import json
-import random
-from collections import defaultdict
-from openai import OpenAI
-from datasets import load_dataset
-from prompt_generation import make_question_prompt, query_asp_output_prompt
+import threading
+from llm_client import shared_client
+from prompt_generation import make_question_prompt, query_asp_output_prompt, compact_question_prompt, \
+    relevant_facts, story_questions_prompt
+from asp_store import AspResultsStore, STORE_PATH, build_store
+from answer_sets import AnswerSets, ANSWER_SETS_PATH, build_answer_sets
+from entailment import derive_predicates
+from predicate_router import route_question, CONFIDENCE_THRESHOLD
+from fast_path import answer_question
+from tracing import tracer, traced_instance
 
 
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
 MODEL = "gpt-3.5-turbo"
 DATA = 'TimeQA_TGR'
 
-# Load ASP results (facts per story)
-with open("results/asp_results.json") as f:
-    asp_results = json.load(f)
+# where stage 2 facts come from by default: "store" looks them up in the precomputed results (SQLite),
+# "columnar" in the precomputed results as columnar answer sets (.npz),
+# "on_demand" grounds only the predicates chosen in stage 1 for the story's instance file
+ASP_SOURCES = ("store", "columnar", "on_demand")
+ASP_SOURCE = "store"
+
+# precomputed ASP results per source, opened on first use (see asp_results); they are (re)built from
+# ASP_RESULTS_JSON, the output of entailment.py, when they are missing or older than it
+ASP_RESULTS_JSON = "results/asp_results.json"
+_asp_results = {}
+_asp_results_lock = threading.Lock()
+ENCODING = "src/tg_reasoner.lp"
+ASP_INSTANCE_DIRS = ["ASPinstances/TGQA", "ASPinstances/TimeQA"]
+
+# pipeline options (see pipeline_options); all off by default, so results stay comparable with the stored
+# baseline results, and every result records the options it was produced with under "pipeline_options"
+
+# choose predicates for template questions without the stage 1 LLM call
+# (falls back to the LLM when the router's confidence is below CONFIDENCE_THRESHOLD)
+USE_ROUTER = False
+
+# answer questions the story's event times determine without any LLM call (see fast_path.fast_path_report)
+USE_FAST_PATH = False
+
+# stage 2 prompt compaction: keep only facts about events named in the question or candidates,
+# do not send the TG twice, and cap the prompt at PROMPT_TOKEN_BUDGET tokens (None for no cap)
+COMPACT_PROMPTS = False
+PROMPT_TOKEN_BUDGET = 4000
+
+
+def pipeline_options(use_router=USE_ROUTER, use_fast_path=USE_FAST_PATH, compact_prompts=COMPACT_PROMPTS,
+                     prompt_token_budget=PROMPT_TOKEN_BUDGET, asp_source=ASP_SOURCE) -> dict:
+    """options of one run of the pipeline, as passed to run_instance and run_story and recorded in their results"""
+    if asp_source not in ASP_SOURCES:
+        raise ValueError(f"asp_source must be one of {ASP_SOURCES}, not {asp_source}")
+    return {"use_router": use_router, "use_fast_path": use_fast_path, "compact_prompts": compact_prompts,
+            "prompt_token_budget": prompt_token_budget if compact_prompts else None, "asp_source": asp_source}
 
 
 def get_story_key(instance_id: str) -> str:
@@ -32,17 +70,73 @@ def get_story_key(instance_id: str) -> str:
 
     return f"{base}.lp"
 
+def get_instance_path(story_key: str):
+    """path of the ASP instance file for a story key (None if there is none)"""
+    for inst_dir in ASP_INSTANCE_DIRS:
+        path = os.path.join(inst_dir, story_key)
+        if os.path.exists(path):
+            return path
+    return None
+
+def refresh_asp_results(path, build):
+    """rebuild precomputed ASP results at path with build(ASP_RESULTS_JSON, path) if they are missing or stale"""
+    if not os.path.exists(ASP_RESULTS_JSON):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"neither {path} nor {ASP_RESULTS_JSON} exists, run entailment.py first")
+        return
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(ASP_RESULTS_JSON):
+        print(f"Building {path} from {ASP_RESULTS_JSON}")
+        build(ASP_RESULTS_JSON, path)
+
+def asp_results(source=ASP_SOURCE):
+    """
+    precomputed ASP results (facts per story and predicate) of the "store" or "columnar" source, opened on first use
+    and rebuilt first if entailment.py wrote newer results (see refresh_asp_results)
+    """
+    with _asp_results_lock:
+        if source not in _asp_results:
+            if source == "store":
+                refresh_asp_results(STORE_PATH, build_store)
+                _asp_results[source] = AspResultsStore(STORE_PATH)
+            elif source == "columnar":
+                refresh_asp_results(ANSWER_SETS_PATH, build_answer_sets)
+                _asp_results[source] = AnswerSets(ANSWER_SETS_PATH)
+            else:
+                raise ValueError(f"precomputed ASP results are in 'store' or 'columnar', not {source}")
+        return _asp_results[source]
+
 def load_system_prompt():
     with open("src/prompts/system.txt", "r") as f:
         return f.read()
 
 
-def run_instance(instance, system_prompt=load_system_prompt(), temperature=0):
-    """Run one dataset instance through the two-step LLM pipeline."""
+def fast_path_result(instance, options):
+    """the result of an instance the fast path answers (see fast_path.answer_question), else None"""
+    if not options["use_fast_path"] or "TG" not in instance:
+        return None
+    with tracer.span("fast_path", instance["id"]) as span:
+        fast_answer, fast_rule = answer_question(instance["question"], instance["candidates"], instance["TG"])
+        span.set("answered", fast_answer is not None)
+    if fast_answer is None:
+        return None
+    return {
+        "answer_source": "fast_path",
+        "fast_path_rule": fast_rule,
+        "answer_choice": fast_answer,
+        "gold_answer": instance["answer"],
+        "match": fast_answer in instance["answer"],
+        "instance_question": instance["question"],
+        "instance_candidates": instance["candidates"],
+        "instance_gold_answer": instance["answer"],
+        "instance_qtype": instance.get("Q-Type"),
+        "instance_id": instance["id"],
+        "pipeline_options": options
+    }
 
-    # --- Stage 1: predicate choice ---
-    query_prompt = query_asp_output_prompt(instance["question"])
-    stage1_resp = client.chat.completions.create(
+def stage1_request(question, system_prompt, temperature=0):
+    """chat completion request asking the LLM for predicate types, and its user prompt"""
+    query_prompt = query_asp_output_prompt(question)
+    request = dict(
         model=MODEL,
         messages=[
             {"role": "system", "content": system_prompt},
@@ -50,40 +144,52 @@ def run_instance(instance, system_prompt=load_system_prompt(), temperature=0):
         ],
         temperature=temperature,
     )
-    stage1_text = stage1_resp.choices[0].message.content
+    return request, query_prompt
+
+def parse_stage1(stage1_text):
+    """predicate_choice of a stage 1 response, as a list"""
     try:
         stage1_json = json.loads(stage1_text)
         predicate_choice = stage1_json["predicate_choice"]
     except Exception:
         raise ValueError(f"Stage 1 output not valid JSON: {stage1_text}")
-
     # Normalize predicate_choice to always be a list
     if isinstance(predicate_choice, str):
         predicate_choice = [predicate_choice]
+    return predicate_choice
 
-    # --- Stage 2: answer selection ---
-    # --- Stage 2: answer selection ---
-    story_key = get_story_key(instance["id"])
-    if story_key not in asp_results:
-        raise KeyError(f"{story_key} not found in asp_results.json")
-
-    asp_facts = []
-    for pred in predicate_choice:
-        asp_facts.extend(asp_results[story_key].get(pred, []))
+def stage2_request(instance, asp_facts, system_prompt, options):
+    """
+    chat completion request asking the LLM for the answer
 
+    Return:
+        (request, question prompt, compaction report or None)
+    """
     candidates_str = "\n".join(instance["candidates"])
     events_str = "\n".join(instance["TG"]) if "TG" in instance else ""  # base events
     tg_str = "\n".join(instance["TG"]) if "TG" in instance else ""      # temporal graph
 
-    question_prompt = make_question_prompt(
-        instance["question"],
-        asp_facts,
-        candidates_str,
-        events_str,
-        tg_str  # NEW: pass TG explicitly
-    )
-
-    stage2_resp = client.chat.completions.create(
+    with tracer.span("prompt", instance["id"]):
+        if options["compact_prompts"]:
+            question_prompt, compaction = compact_question_prompt(
+                instance["question"],
+                asp_facts,
+                candidates_str,
+                events_str,
+                tg_str,
+                token_budget=options["prompt_token_budget"]
+            )
+        else:
+            question_prompt = make_question_prompt(
+                instance["question"],
+                asp_facts,
+                candidates_str,
+                events_str,
+                tg_str  # NEW: pass TG explicitly
+            )
+            compaction = None
+
+    request = dict(
         model=MODEL,
         messages=[
             {"role": "system", "content": system_prompt},
@@ -91,26 +197,85 @@ def run_instance(instance, system_prompt=load_system_prompt(), temperature=0):
         ],
         temperature=0,
     )
-    stage2_text = stage2_resp.choices[0].message.content
+    return request, question_prompt, compaction
+
+def parse_stage2(stage2_text):
+    """answer_choice of a stage 2 response"""
     try:
-        answer_choice = json.loads(stage2_text)["answer_choice"]
+        return json.loads(stage2_text)["answer_choice"]
     except Exception:
         raise ValueError(f"Stage 2 output not valid JSON: {stage2_text}")
 
+def choose_predicates(instance, system_prompt, temperature, client, options):
+    """
+    stage 1: predicate types for the instance's question, from the router or the LLM
+
+    Return:
+        (predicate_choice as a list, stage 1 report with the keys of run_instance's results)
+    """
+    with tracer.span("stage1", instance["id"]) as span:
+        request, query_prompt = stage1_request(instance["question"], system_prompt, temperature)
+        routed_choice, router_confidence, _ = route_question(instance["question"])
+        if options["use_router"] and router_confidence >= CONFIDENCE_THRESHOLD:
+            predicate_choice = routed_choice
+            stage1_text = None
+            stage1_source = "router"
+        else:
+            if client is None:
+                client = shared_client()
+            stage1_resp = client.chat.completions.create(**request)
+            span.record_usage(stage1_resp)
+            stage1_text = stage1_resp.choices[0].message.content
+            predicate_choice = parse_stage1(stage1_text)
+            stage1_source = "llm"
+        span.set("source", stage1_source)
+
+    return predicate_choice, {
+        "system_prompt_stage1": system_prompt,
+        "query_prompt": query_prompt,
+        "stage1_response": stage1_text,
+        "stage1_source": stage1_source,
+        "router_confidence": router_confidence,
+        "predicate_choice": predicate_choice,
+    }
+
+def lookup_facts(instance, predicate_choice, asp_source=ASP_SOURCE):
+    """ASP facts of the chosen predicate types for the instance's story, from one of ASP_SOURCES"""
+    story_key = get_story_key(instance["id"])
+    with tracer.span("asp_lookup", instance["id"]) as span:
+        asp_facts = []
+        if asp_source == "on_demand":
+            instance_path = get_instance_path(story_key)
+            if instance_path is None:
+                raise KeyError(f"{story_key} not found in {ASP_INSTANCE_DIRS}")
+            derived = derive_predicates(ENCODING, instance_path, predicate_choice)
+            for pred in predicate_choice:
+                asp_facts.extend(derived[pred])
+        else:
+            results = asp_results(asp_source)
+            if story_key not in results:
+                raise KeyError(f"{story_key} not found in the ASP results")
+            for pred in predicate_choice:
+                asp_facts.extend(results.get(story_key, pred, []))
+        span.set("facts", len(asp_facts))
+    return asp_facts
+
+
+def llm_result(instance, stage1, system_prompt, question_prompt, compaction, stage2_text, answer_choice, options):
+    """result of an instance answered by the LLM (stage1 as returned by choose_predicates)"""
     # --- Check correctness ---
     gold_answer = instance["answer"]
     match = answer_choice in gold_answer
 
     return {
         # System + prompts + responses
-        "system_prompt_stage1": system_prompt,
-        "query_prompt": query_prompt,
-        "stage1_response": stage1_text,
-        "predicate_choice": predicate_choice,
+        **stage1,
         "system_prompt_stage2": system_prompt,
         "question_prompt": question_prompt,
+        "compaction": compaction,
         "stage2_response": stage2_text,
         "answer_choice": answer_choice,
+        "answer_source": "llm",
 
         # Ground truth
         "gold_answer": gold_answer,
@@ -120,89 +285,161 @@ def run_instance(instance, system_prompt=load_system_prompt(), temperature=0):
         "instance_question": instance["question"],
         "instance_candidates": instance["candidates"],
         "instance_gold_answer": instance["answer"],
-        "instance_id": instance["id"]
+        "instance_qtype": instance.get("Q-Type"),
+        "instance_id": instance["id"],
+        "pipeline_options": options
     }
 
 
-# -----------------------------
-# Sampling functions
-# -----------------------------
+@traced_instance
+def run_instance(instance, system_prompt=load_system_prompt(), temperature=0, client=None, options=None):
+    """Run one dataset instance through the two-step LLM pipeline (options from pipeline_options, default: all off)."""
+    if options is None:
+        options = pipeline_options()
+
+    # --- Fast path: answer from the TG's event times if exactly one candidate is consistent ---
+    fast_result = fast_path_result(instance, options)
+    if fast_result is not None:
+        return fast_result
 
-def sample_random(dataset, n=50, seed=42):
-    random.seed(seed)
-    return random.sample(list(dataset), n)
+    # --- Stage 1: predicate choice ---
+    predicate_choice, stage1 = choose_predicates(instance, system_prompt, temperature, client, options)
 
+    # --- Stage 2: answer selection ---
+    asp_facts = lookup_facts(instance, predicate_choice, options["asp_source"])
 
-def sample_stratified(dataset, n=50, seed=42):
-    random.seed(seed)
-    buckets = defaultdict(list)
-    for inst in dataset:
-        qtype = inst.get("Q-Type") or "Unknown"
-        buckets[qtype].append(inst)
+    request, question_prompt, compaction = stage2_request(instance, asp_facts, system_prompt, options)
 
-    # if all Q-Types are "Unknown", just sample randomly
-    if len(buckets) == 1 and "Unknown" in buckets:
-        return sample_random(dataset, n, seed)
+    if client is None:
+        client = shared_client()
+    with tracer.span("stage2", instance["id"]) as span:
+        stage2_resp = client.chat.completions.create(**request)
+        span.record_usage(stage2_resp)
+    stage2_text = stage2_resp.choices[0].message.content
+    answer_choice = parse_stage2(stage2_text)
 
-    n_types = len(buckets)
-    per_type = max(1, n // n_types)
+    return llm_result(instance, stage1, system_prompt, question_prompt, compaction, stage2_text, answer_choice,
+                      options)
 
-    sampled = []
-    for qtype, items in buckets.items():
-        if items:
-            sampled.extend(random.sample(items, min(per_type, len(items))))
 
-    return sampled
-def sample_stratified(dataset, n=50, seed=42):
-    random.seed(seed)
-    buckets = defaultdict(list)
-    for inst in dataset:
-        qtype = inst.get("Q-Type") or "Unknown"
-        buckets[qtype].append(inst)
+# -----------------------------
+# Multi-question requests
+# -----------------------------
 
-    # if all Q-Types are "Unknown", just sample randomly
-    if len(buckets) == 1 and "Unknown" in buckets:
-        return sample_random(dataset, n, seed)
+def group_by_story(subset):
+    """
+    questions sharing a TG, grouped in order of first appearance
 
-    n_types = len(buckets)
-    per_type = max(1, n // n_types)
+    Return:
+        A list of {"id": id of the group's first instance, "instances": [...]}; instances without a TG
+        form groups of their own
+    """
+    groups = {}
+    for instance in subset:
+        key = "\n".join(instance["TG"]) if "TG" in instance else instance["id"]
+        if key not in groups:
+            groups[key] = {"id": instance["id"], "instances": []}
+        groups[key]["instances"].append(instance)
+    return list(groups.values())
 
-    sampled = []
-    for qtype, items in buckets.items():
-        if items:
-            sampled.extend(random.sample(items, min(per_type, len(items))))
 
-    return sampled
+def run_story(group, system_prompt=load_system_prompt(), temperature=0, client=None, questions_per_request=8,
+              options=None):
+    """
+    answer the questions of one story with up to questions_per_request questions per stage 2 request
 
+    stage 1 and the ASP lookup run per question as in run_instance; the stage 2 prompt puts the
+    story's TG before the questions (see prompt_generation.story_questions_prompt) and the response
+    is a JSON array with one answer per question
 
-# -----------------------------
-# Batch runner
-# -----------------------------
+    Return:
+        One result per instance of the group, in the schema of run_instance (or {"error": ...})
+    """
+    if options is None:
+        options = pipeline_options()
+    instances = group["instances"]
+    results = [None] * len(instances)
+    pending = []
+    for i, instance in enumerate(instances):
+        try:
+            results[i] = fast_path_result(instance, options)
+            if results[i] is None:
+                predicate_choice, stage1 = choose_predicates(instance, system_prompt, temperature, client, options)
+                pending.append((i, stage1, lookup_facts(instance, predicate_choice, options["asp_source"])))
+        except Exception as e:
+            results[i] = {"error": str(e)}
 
-def run_batch(n=50, mode="random", output_path=f"results/llm_results_{MODEL}_{DATA}.json", data=DATA):
-    dataset = load_dataset("sxiong/TGQA", data)["test" if data == 'TGQA_TGR' else 'hard_test']
+    tg_str = "\n".join(instances[0]["TG"]) if "TG" in instances[0] else ""
+    for start in range(0, len(pending), questions_per_request):
+        chunk = pending[start:start + questions_per_request]
+        questions = []
+        for i, _, asp_facts in chunk:
+            instance = instances[i]
+            if options["compact_prompts"]:
+                asp_facts = relevant_facts(asp_facts, instance["question"], "\n".join(instance["candidates"]))
+            questions.append((instance["question"], asp_facts, instance["candidates"]))
 
-    if mode == "random":
-        subset = sample_random(dataset, n)
-    elif mode == "stratified":
-        subset = sample_stratified(dataset, n)
-    else:
-        raise ValueError("mode must be 'random' or 'stratified'")
+        with tracer.span("prompt", group["id"]):
+            question_prompt = story_questions_prompt(tg_str, questions)
 
-    results = {}
-    for i, instance in enumerate(subset):
-        print(f"Processing {instance['id']} ({i+1}/{len(subset)})...")
         try:
-            results[instance["id"]] = run_instance(instance)
+            if client is None:
+                client = shared_client()
+            with tracer.span("stage2", group["id"]) as span:
+                stage2_resp = client.chat.completions.create(
+                    model=MODEL,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": question_prompt},
+                    ],
+                    temperature=0,
+                )
+                span.record_usage(stage2_resp)
+                span.set("questions", len(chunk))
+            stage2_text = stage2_resp.choices[0].message.content
+            try:
+                answers = {int(answer["question_id"]): answer["answer_choice"] for answer in json.loads(stage2_text)}
+            except Exception:
+                raise ValueError(f"Stage 2 output not a valid JSON array: {stage2_text}")
         except Exception as e:
-            results[instance["id"]] = {"error": str(e)}
+            for i, _, _ in chunk:
+                results[i] = {"error": str(e)}
+            continue
 
-    with open(output_path, "w") as f:
-        json.dump(results, f, indent=2)
+        for question_id, (i, stage1, _) in enumerate(chunk, start=1):
+            instance = instances[i]
+            if question_id not in answers:
+                results[i] = {"error": f"Stage 2 output has no answer to question {question_id}: {stage2_text}"}
+                continue
+            results[i] = llm_result(instance, stage1, system_prompt, question_prompt, None, stage2_text,
+                                    answers[question_id], options)
+            results[i]["stage2_batch"] = {"questions": len(chunk), "question_id": question_id}
+    return results
 
-    print(f" Saved results for {len(subset)} instances to {output_path}")
+
+# -----------------------------
+# Batch runner
+# -----------------------------
+
+def run_batch(n=50, mode="random", output_path=None, data=DATA, concurrency=1, rpm=None, tpm=None, trace_path=None,
+              questions_per_request=1, resume=False, use_router=USE_ROUTER, use_fast_path=USE_FAST_PATH,
+              compact_prompts=COMPACT_PROMPTS, asp_source=ASP_SOURCE):
+    """
+    run the ASP-augmented pipeline on a sample (see experiment_runner.run_experiment)
+
+    Args:
+        questions_per_request (int) with more than 1, questions about the same story are answered
+            together, up to this many per stage 2 request (see run_story)
+        use_router, use_fast_path, compact_prompts (bool) pipeline options (see pipeline_options), all off by default
+        asp_source (str) where stage 2 facts come from, one of ASP_SOURCES
+    """
+    from experiment_runner import run_experiment
+    run_experiment(["asp"], n=n, mode=mode, data=data, output_paths={"asp": output_path}, concurrency=concurrency,
+                   rpm=rpm, tpm=tpm, trace_path=trace_path, resume=resume, questions_per_request=questions_per_request,
+                   use_router=use_router, use_fast_path=use_fast_path, compact_prompts=compact_prompts,
+                   asp_source=asp_source)
 
 
 if __name__ == "__main__":
     # Example: run 50 stratified samples
-    run_batch(n=500, mode="stratified")
\ No newline at end of file
+    run_batch(n=500, mode="stratified")
@@ -1,11 +1,7 @@
-import os
 import json
-import random
-from collections import defaultdict
-from openai import OpenAI
-from datasets import load_dataset
+from llm_client import shared_client
+from tracing import tracer, traced_instance
 
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
 MODEL = "gpt-3.5-turbo"
 DATA = "TimeQA_TGR"  # or "TimeQA_TGR"
 
@@ -14,7 +10,8 @@ def load_system_prompt():
         return f.read()
 
 
-def run_instance_tg_only(instance, system_prompt=load_system_prompt(), temperature=0):
+@traced_instance
+def run_instance_tg_only(instance, system_prompt=load_system_prompt(), temperature=0, client=None):
     """Run one dataset instance using only the temporal graph (TG) + question (no ASP facts, no story)."""
 
     # --- Build prompt ---
@@ -47,14 +44,18 @@ Instructions:
 """
 
     # --- Query model ---
-    resp = client.chat.completions.create(
-        model=MODEL,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": question_prompt},
-        ],
-        temperature=temperature,
-    )
+    if client is None:
+        client = shared_client()
+    with tracer.span("answer", instance["id"]) as span:
+        resp = client.chat.completions.create(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": question_prompt},
+            ],
+            temperature=temperature,
+        )
+        span.record_usage(resp)
     resp_text = resp.choices[0].message.content
     try:
         answer_choice = json.loads(resp_text)["answer_choice"]
@@ -80,70 +81,21 @@ Instructions:
         "instance_question": instance["question"],
         "instance_candidates": instance["candidates"],
         "instance_gold_answer": instance["answer"],
+        "instance_qtype": instance.get("Q-Type"),
         "instance_id": instance["id"]
     }
 
 
-# -----------------------------
-# Sampling functions
-# -----------------------------
-
-def sample_random(dataset, n=50, seed=42):
-    random.seed(seed)
-    return random.sample(list(dataset), n)
-
-
-def sample_stratified(dataset, n=50, seed=42):
-    random.seed(seed)
-    buckets = defaultdict(list)
-    for inst in dataset:
-        qtype = inst.get("Q-Type") or "Unknown"
-        buckets[qtype].append(inst)
-
-    # if all Q-Types are "Unknown", just sample randomly
-    if len(buckets) == 1 and "Unknown" in buckets:
-        return sample_random(dataset, n, seed)
-
-    n_types = len(buckets)
-    per_type = max(1, n // n_types)
-
-    sampled = []
-    for qtype, items in buckets.items():
-        if items:
-            sampled.extend(random.sample(items, min(per_type, len(items))))
-
-    return sampled
-
-
 # -----------------------------
 # Batch runner
 # -----------------------------
 
-def run_batch_tg_only(n=50, mode="random", output_path=None, data=DATA):
-    dataset = load_dataset("sxiong/TGQA", data)["test" if data == "TGQA_TGR" else "hard_test"]
-
-    if mode == "random":
-        subset = sample_random(dataset, n)
-    elif mode == "stratified":
-        subset = sample_stratified(dataset, n)
-    else:
-        raise ValueError("mode must be 'random' or 'stratified'")
-
-    if output_path is None:
-        output_path = f"results/llm_results_tg_only_{MODEL}_{data}.json"
-
-    results = {}
-    for i, instance in enumerate(subset):
-        print(f"[TG-only] Processing {instance['id']} ({i+1}/{len(subset)})...")
-        try:
-            results[instance["id"]] = run_instance_tg_only(instance)
-        except Exception as e:
-            results[instance["id"]] = {"error": str(e)}
-
-    with open(output_path, "w") as f:
-        json.dump(results, f, indent=2)
-
-    print(f"Saved TG-only results for {len(subset)} instances to {output_path}")
+def run_batch_tg_only(n=50, mode="random", output_path=None, data=DATA,
+                      concurrency=1, rpm=None, tpm=None, trace_path=None, resume=False):
+    """run this module's strategy on a sample (see experiment_runner.run_experiment)"""
+    from experiment_runner import run_experiment
+    run_experiment(["tg_only"], n=n, mode=mode, data=data, output_paths={"tg_only": output_path},
+                   concurrency=concurrency, rpm=rpm, tpm=tpm, trace_path=trace_path, resume=resume)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+# deterministic stage 1: map a question to the predicate types needed to answer it
+# TGQA questions follow a small set of templates, so most of them do not need an LLM call to choose predicates
+
+import os
+import re
+import json
+from collections import Counter
+
+# questions routed with at least this confidence skip the stage 1 LLM call
+CONFIDENCE_THRESHOLD = 0.8
+
+# question templates (TGQA), checked in order: (name, pattern, predicate_choice, confidence)
+TEMPLATES = [
+    ("start", r"^When did the event \(.+\) start\?$", ["starts_at"], 0.95),
+    ("duration", r"^How long did the event \(.+\) last\?$", ["length"], 0.95),
+    ("same_year", r"^True or false: event \(.+\) and event \(.+\) started at the same year\?$",
+     ["started_same_year"], 0.95),
+    ("time_passed", r"^How much time passed between the start of event \(.+\) and the start of event \(.+\)\?$",
+     ["time_passed"], 0.95),
+    ("started_first", r"^Which event started first, \(.+\) or \(.+\)\?$", ["ordering_on_start_years"], 0.9),
+    ("longer", r"^True or false: event \(.+\) was longer in duration than event \(.+\)\?$", ["length"], 0.9),
+    ("still_happening", r"^True or false: event \(.+\) was still happening when event \(.+\) started\?$",
+     ["was_still_happening"], 0.95),
+    ("neighbour_of_start", r"^What happened right (before|after) the event \(.+\) starts\?$",
+     ["ordering_on_start_years"], 0.9),
+    # ordering_on_start_years says nothing about ends, so leave these to the LLM
+    ("neighbour_of_end", r"^What happened right (before|after) the event \(.+\) ends\?$",
+     ["ordering_on_start_years"], 0.6),
+    ("nth_event", r"^Given the following .+ events: .+ Which event is the \w+ one in chronological order\?$",
+     ["ordering_on_start_years"], 0.95),
+]
+COMPILED_TEMPLATES = [(name, re.compile(pattern, re.DOTALL), choice, confidence)
+                      for name, pattern, choice, confidence in TEMPLATES]
+
+# keyword features for questions outside the templates (e.g. paraphrases), always below the threshold
+KEYWORDS = [
+    ("same year", ["started_same_year"]),
+    ("still happening", ["was_still_happening"]),
+    ("time passed", ["time_passed"]),
+    ("how long", ["length"]),
+    ("duration", ["length"]),
+    ("chronological", ["ordering_on_start_years"]),
+    ("first", ["ordering_on_start_years"]),
+    ("start", ["starts_at"]),
+]
+KEYWORD_CONFIDENCE = 0.5
+
+
+def route_question(question: str):
+    """
+    choose predicate types for a question without calling the LLM
+
+    Return:
+        (predicate_choice, confidence, rule) where predicate_choice is None and confidence 0
+        if neither a template nor a keyword applies
+    """
+    question = question.strip()
+    for name, pattern, choice, confidence in COMPILED_TEMPLATES:
+        if pattern.match(question):
+            return list(choice), confidence, name
+
+    lowered = question.lower()
+    for keyword, choice in KEYWORDS:
+        if keyword in lowered:
+            return list(choice), KEYWORD_CONFIDENCE, f"keyword:{keyword}"
+
+    return None, 0.0, None
+
+
+def router_report(results_dir="results", threshold=CONFIDENCE_THRESHOLD):
+    """
+    measure the router on the questions of stored LLM result files
+
+    coverage is the share of all stored questions the router would answer itself (confidence >= threshold);
+    agreement is measured only on the routed questions whose stored result has a stage 1 choice made by
+    the LLM, as the share where the router picks the same predicate set
+    """
+    total = 0
+    covered = 0
+    compared = 0
+    agreed = 0
+    per_rule = Counter()
+    per_rule_compared = Counter()
+    per_rule_agreed = Counter()
+
+    for fname in sorted(os.listdir(results_dir)):
+        if not fname.endswith(".json") or fname == "asp_results.json":
+            continue
+        with open(os.path.join(results_dir, fname)) as f:
+            results = json.load(f)
+
+        for res in results.values():
+            if "instance_question" not in res:
+                continue
+            total += 1
+            choice, confidence, rule = route_question(res["instance_question"])
+            if confidence < threshold:
+                continue
+            covered += 1
+            per_rule[rule] += 1
+
+            # only stage 1 choices made by the LLM are a reference
+            if "predicate_choice" not in res or res.get("stage1_source", "llm") != "llm":
+                continue
+            compared += 1
+            per_rule_compared[rule] += 1
+            if set(choice) == set(res["predicate_choice"]):
+                agreed += 1
+                per_rule_agreed[rule] += 1
+
+    report = {
+        "questions": total,
+        "coverage": covered / total if total else 0.0,
+        "compared": compared,
+        "agreement": agreed / compared if compared else 0.0,
+        "rules": {rule: {"routed": n, "compared": per_rule_compared[rule],
+                         "agreement": (per_rule_agreed[rule] / per_rule_compared[rule]
+                                       if per_rule_compared[rule] else 0.0)}
+                  for rule, n in per_rule.items()},
+    }
+
+    print(f"Router coverage: {covered}/{total} stored questions")
+    print(f"Router agreement: {agreed}/{compared} routed questions with a stored LLM stage 1 choice")
+    for rule, stats in sorted(report["rules"].items()):
+        agreement = f"{stats['agreement']*100:.1f}% agreement" if stats["compared"] else "no stored choices"
+        print(f"  {rule}: {stats['routed']} routed, {stats['compared']} compared, {agreement}")
+    return report
+
+
+if __name__ == "__main__":
+    router_report()
@@ -1,3 +1,10 @@
+import re
+import unicodedata
+
+# event(S, R, O) terms inside derived facts (first three arguments of event/7 facts)
+EVENT_TERM = re.compile(r"event\(([^,()]+),([^,()]+),([^,()]+)")
+
+
 def make_question_prompt(question: str, asp_facts: str, candidates: str, events: str, TG: list) -> str:
     """
     Build the question prompt given:
@@ -29,4 +36,103 @@ def query_asp_output_prompt(question: str) -> str:
     with open('src/prompts/query_asp_output.txt') as f:
         query_template = f.read()
     
-    return query_template.replace('$QUESTION', question)
\ No newline at end of file
+    return query_template.replace('$QUESTION', question)
+
+def estimate_tokens(text: str) -> int:
+    """rough token count of a prompt (about four characters per token)"""
+    return len(text) // 4
+
+
+def normalize_term(text: str) -> str:
+    """
+    bring natural language names and ASP terms into the same form, e.g.
+    'Kingston, Wyoming' and 'kingston__wyoming' both become 'kingston__wyoming'
+    """
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+    return re.sub(r"[^a-z0-9]", "_", text)
+
+
+def relevant_facts(asp_facts: list, question: str, candidates: str) -> list:
+    """
+    keep the facts whose events are named in the question or candidates
+
+    an event(S, R, O) counts as named if both S and O occur in the text; facts about several events
+    are kept if all of them are named, falling back to facts with at least one named event,
+    and to all facts if nothing is named at all
+    """
+    text = "_" + normalize_term(question + "\n" + candidates) + "_"
+
+    def named(term):
+        return f"_{normalize_term(term).strip('_')}_" in text
+
+    all_named, any_named = [], []
+    for fact in asp_facts:
+        events = [named(s) and named(o) for s, _, o in EVENT_TERM.findall(fact)]
+        if events and all(events):
+            all_named.append(fact)
+        if any(events):
+            any_named.append(fact)
+
+    return all_named or any_named or list(asp_facts)
+
+
+def compact_question_prompt(question: str, asp_facts: list, candidates: str, events: str, TG: str,
+                            token_budget=None):
+    """
+    make_question_prompt with only the relevant facts, without repeating the TG as events
+    (run_instance passes the same text for both) and with facts dropped from the end
+    until the prompt fits token_budget
+
+    Return:
+        The prompt and a report of the facts and tokens saved against the full prompt
+    """
+    full_prompt = make_question_prompt(question, asp_facts, candidates, events, TG)
+
+    if events == TG:
+        events = "(identical to the Temporal Graph below)"
+    facts = relevant_facts(asp_facts, question, candidates)
+
+    if token_budget is not None:
+        available = token_budget - estimate_tokens(make_question_prompt(question, [], candidates, events, TG))
+        kept, used = [], 0
+        for fact in facts:
+            # each fact is rendered as "'<fact>', " inside the list
+            used += estimate_tokens(fact) + 1
+            if used > available:
+                break
+            kept.append(fact)
+        facts = kept
+
+    prompt = make_question_prompt(question, facts, candidates, events, TG)
+    report = {
+        "facts_before": len(asp_facts),
+        "facts_after": len(facts),
+        "tokens_before": estimate_tokens(full_prompt),
+        "tokens_after": estimate_tokens(prompt),
+    }
+    report["tokens_saved"] = report["tokens_before"] - report["tokens_after"]
+    return prompt, report
+
+
+def story_questions_prompt(TG: str, questions: list) -> str:
+    """
+    one prompt for several questions about the same story
+
+    the static instructions come first and the story's TG next, so all requests about a story
+    share one prompt prefix (which providers can cache); only the questions at the end differ
+
+    Args:
+        TG (str) the story's temporal graph
+        questions (list) (question, facts, candidates) per question, with facts as a list of
+            atoms and candidates as a list of strings; questions are numbered from 1 in this order
+    """
+    with open('src/prompts/story_questions.txt') as f:
+        template = f.read()
+
+    blocks = []
+    for question_id, (question, facts, candidates) in enumerate(questions, start=1):
+        blocks.append(f"Question {question_id}:\n{question}\n"
+                      f"Facts:\n" + ("\n".join(facts) or "(none)") + "\n"
+                      f"Candidates:\n" + "\n".join(candidates))
+
+    return template.replace('$TG', TG).replace('$QUESTIONS', "\n\n".join(blocks))
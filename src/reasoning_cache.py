@@ -0,0 +1,142 @@
+# persistent, content-addressed cache of answer sets computed by entailment.run_instances
+# an entry is keyed by the normalized encoding, the normalized facts of an instance and the solver options,
+# so a re-run only solves instances whose facts (or the encoding) changed, and identical TGs share one entry
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import clingo
+from clingo.ast import parse_files, parse_string, ASTType
+
+CACHE_PATH = ".cache/answer_sets.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _collect(statements):
+    """callback for the clingo parser adding the text of each statement, skipping comments"""
+    def add(statement):
+        if statement.ast_type != ASTType.Comment:
+            statements.append(str(statement))
+    return add
+
+
+def encoding_digest(encoding) -> str:
+    """
+    sha256 of an encoding's statements as clingo parses them, so comments, whitespace and
+    line breaks do not change the digest
+    """
+    statements = []
+    parse_files([encoding], _collect(statements))
+    return _digest("\n".join(statements))
+
+
+def facts_digest(fpath) -> str:
+    """sha256 of the set of statements in an instance file, independent of their order, layout and comments"""
+    with open(fpath) as f:
+        text = f.read()
+    statements = []
+    parse_string(text, _collect(statements))
+    return _digest("\n".join(sorted(set(statements))))
+
+
+def result_key(encoding_hash, facts_hash, backend, consts=None) -> str:
+    """key of an instance's answer set: encoding, facts and everything that configures the solver"""
+    options = {"encoding": encoding_hash, "facts": facts_hash, "backend": backend,
+               "consts": {name: str(value) for name, value in (consts or {}).items()},
+               "clingo": clingo.__version__}
+    return _digest(json.dumps(options, sort_keys=True))
+
+
+def cacheable(result: dict) -> bool:
+    """timeouts and errors depend on the time budget and the machine, so they are solved again next time"""
+    return "TIMEOUT" not in result and "ERROR" not in result
+
+
+class ReasoningCache:
+    """
+    SQLite-backed cache of per-instance answer sets (the result dictionaries of entailment.run_instance)
+
+    the least recently used entries are dropped once the stored answer sets exceed max_bytes;
+    it is only accessed from the process that runs run_instances, never from its workers
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=2 * 1024 ** 3, evict_every=100):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self._evict()
+        return self._conn
+
+    def get(self, key):
+        """cached answer set for key, or None"""
+        conn = self._connection()
+        row = conn.execute("SELECT result FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, result: dict) -> None:
+        if not cacheable(result):
+            return
+        text = json.dumps(result)
+        now = time.time()
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", (key, text, len(text), now, now))
+        self._puts += 1
+        if self._puts % self.evict_every == 0:
+            self._evict()
+
+    def _evict(self):
+        conn = self._conn
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            stale.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    def stats(self) -> dict:
+        entries, size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+    def close(self):
+        if self._conn is not None:
+            self._evict()
+            self._conn.close()
+            self._conn = None
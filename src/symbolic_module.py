@@ -1,13 +1,70 @@
 from dateutil import parser
 import re
-from datasets import load_dataset
+from dataset_snapshot import load_split
 import pandas as pd
 import json
+import sys
 import unicodedata
 import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from utils import MONTHS, write_atomic
+
+# manifest of generated instance files (id -> file and hashes), kept next to the files of each TG type
+MANIFEST_NAME = 'manifest.json'
+
+# hash of this module's source: any change to the converter invalidates all entries in a manifest
+with open(__file__, 'rb') as _source:
+    CONVERTER_HASH = hashlib.sha256(_source.read()).hexdigest()
+
+# the bundled TimeQA instance files were generated in September 2025: dates given only as a year got that month
+INSTANCE_FILES_DATE = datetime(2025, 9, 1)
+
+# question ids of the stored LLM results are story ids with a question suffix (story519_Q0_0, /wiki/X#P108_hard_1)
+QUESTION_SUFFIX = re.compile(r'_(?:Q\d+_\d+|easy_\d+|hard_\d+)$')
 
 # print(datasets_['TimeQA_Story_TG_Trans']['TG'])
 
+# explicitly write out all relations as indicated in the TGQA data
+# (the order matters: the first relation found in an event is used, e.g. 'died in' also matches 'studied in',
+# and a plain scan over the phrases is faster than a regex alternation on these short strings)
+TGQA_RELATIONS = {
+                'was born in': 'born_in',
+                'was birthed in': 'born_in',
+                'entered the world in': 'born_in',
+                'died in': 'die',
+                'passed away in': 'die',
+                'expired in': 'die',
+                'worked at': 'work_at',
+                'served at': 'work_at',
+                'employed by': 'work_at',
+                'played for': 'play_for',
+                'joined': 'play_for',
+                'won prize': 'win_prize',
+                'received award': 'win_prize',
+                'received prize': 'win_prize',
+                'was married to': 'married_to',
+                'tied the knot with': 'married_to',
+                'united in marriage with': 'married_to',
+                'owned': 'own',
+                'possessed': 'own',
+                'studied in': 'study',
+                'educated in': 'study',
+                'was affiliated to': 'affiliated_to',
+                'was a member of': 'affiliated_to',
+                'was associated with': 'affiliated_to',
+                'created': 'create',
+                'produced': 'create',
+                'crafted': 'create'
+                }
+
+# fast path for the common TimeQA date forms "Mon YYYY" and "YYYY"; anything else goes to dateutil
+DATE_PATTERN = re.compile(r'^(?:([A-Za-z]+)\s+)?([1-9]\d{3})$')
+
+
+@lru_cache(maxsize=65536)
 def clean_term(i: str):
     if i[0].isdigit():
         i = '_' + i
@@ -17,136 +74,151 @@ def clean_term(i: str):
     return i
 
 
-def tg_to_asp(TG, TG_type: str) -> str:
+def parse_year_month(date: str, default: datetime):
+    """
+    (year, month) of a TimeQA date, as dateutil.parser.parse(date, default=default) would give it;
+    without a month, dateutil takes the month of default
+    """
+    match = DATE_PATTERN.match(date)
+    if match:
+        month_name, year = match.groups()
+        if month_name is None:
+            return int(year), default.month
+        if month_name.lower() in MONTHS:
+            return int(year), MONTHS[month_name.lower()]
+    parsed = parser.parse(date, default=default)
+    return parsed.year, parsed.month
+
+
+@lru_cache(maxsize=65536)
+def parse_tgqa_event(temporal_event: str):
+    """
+    split one TGQA TG entry like "(X was born in Y) starts at 1990" into
+    (subject, relation token, object, 'starts' or 'ends', year); None if no relation applies
+
+    memoized, since the questions of a story all repeat the story's TG
+    """
+    for relation_type in TGQA_RELATIONS:
+        if relation_type in temporal_event:
+            # Split on the relation
+            parts = temporal_event.split(relation_type)
+            if len(parts) == 2:
+                # First part has subject (remove opening parenthesis)
+                subject = parts[0].strip().replace('(', '').strip().lower().replace(' ', '_')
+                
+                # Second part has object and start/end info
+                second_part = parts[1].strip()
+                
+                # Extract object (everything before ") starts/ends")
+                if ') starts' in second_part:
+                    obj = second_part.split(') starts')[0].strip().lower().replace(' ', '_')
+                    start_or_end = 'starts'
+                    year = int(second_part.split('starts at ')[1])
+                elif ') ends' in second_part:
+                    obj = second_part.split(') ends')[0].strip().lower().replace(' ', '_')
+                    start_or_end = 'ends'
+                    year = int(second_part.split('ends at ')[1])
+                else:
+                    continue
+                
+                return subject, TGQA_RELATIONS[relation_type], obj, start_or_end, year  # Found matching relation
+    return None
+
+
+@lru_cache(maxsize=65536)
+def timeqa_event_facts(temporal_event: str, default_date: datetime):
+    """
+    event facts of one TimeQA TG entry like "1976 - 1978 : X's employer is ( Y )"; None if its format is not recognized
+
+    memoized, since the questions of a story all repeat the story's TG
+    """
+    # extract time interval and event
+    interval, event = temporal_event.split(':')
+    # split to get start str and end string separately
+    if '-' in interval:
+        start_date, end_date = interval.split('-')
+    else:
+        start_date, end_date = interval, interval
+    # parse start and end strings into year and month
+    start_year, start_moth = parse_year_month(start_date.strip(), default_date)
+    end_year, end_month = parse_year_month(end_date.strip(), default_date)
+    
+    # extract entities (nodes) in temporal graph
+    poss_match = re.match(r"(.+?)'s\s+(.*?)\s+", event.strip())
+    
+    if poss_match:
+        out_node = poss_match.group(1).strip().lower().replace(' ', '_')
+        relation = poss_match.group(2).strip().lower().replace(' ', '_')
+        
+        # Find all objects in parentheses
+        in_nodes = re.findall(r'\(\s*([^)]+)\s*\)', event.strip())
+        in_nodes = [node.strip().lower().replace(' ', '_') for node in in_nodes]
+    
+    else:
+        # Assumes format like "Galatasaray S.K. (football) is ( Unknown )"
+        direct_match = re.match(r"(.+?)\s+(\w+)\s+", event.strip())
+        
+        if not direct_match:
+            return None
+        
+        out_node = direct_match.group(1).strip().lower().replace(' ', '_')
+        relation = direct_match.group(2).strip().lower().replace(' ', '_')
+        
+        # Find all objects in parentheses
+        in_nodes = re.findall(r'\(\s*([^)]+)\s*\)', event.strip())
+        in_nodes = [node.strip().lower().replace(' ', '_') for node in in_nodes]
+    
+    return tuple(f'event({clean_term(out_node)}, {clean_term(relation)}, {clean_term(in_node)}, {start_year}, {start_moth}, {end_year}, {end_month}).\n'
+                 for in_node in in_nodes)
+
+
+def tg_to_asp(TG, TG_type: str, default_date: datetime = None) -> str:
     """
     transforms a temporal graph to a string which can be written as content into an ASP instance file
     
     Args:
         TG (list) a temporal graph object encoding some story
+        default_date (datetime) fills in missing date parts of TimeQA dates, like dateutil does
+            (default: today, so a date given only as a year gets the current month)
     
     Return:
         A string containing valid ASP code to be written into an instance file
     """
     if TG_type == 'TGQA':
-        # explicitl write out all relations as indicated in the TGQA data
-        relation_dict = {
-                        'was born in': 'born_in',
-                        'was birthed in': 'born_in',
-                        'entered the world in': 'born_in',
-                        'died in': 'die',
-                        'passed away in': 'die',
-                        'expired in': 'die',
-                        'worked at': 'work_at',
-                        'served at': 'work_at',
-                        'employed by': 'work_at',
-                        'played for': 'play_for',
-                        'joined': 'play_for',
-                        'won prize': 'win_prize',
-                        'received award': 'win_prize',
-                        'received prize': 'win_prize',
-                        'was married to': 'married_to',
-                        'tied the knot with': 'married_to',
-                        'united in marriage with': 'married_to',
-                        'owned': 'own',
-                        'possessed': 'own',
-                        'studied in': 'study',
-                        'educated in': 'study',
-                        'was affiliated to': 'affiliated_to',
-                        'was a member of': 'affiliated_to',
-                        'was associated with': 'affiliated_to',
-                        'created': 'create',
-                        'produced': 'create',
-                        'crafted': 'create'
-                        }
-        
         # dictionary to store ongoing events (since start and end have different entries in the graph)
         ongoing_events = {}
         # facts to be written into an asp instance file
-        facts = ''
+        facts = []
         for temporal_event in TG:
-            for relation_type in relation_dict:
-                if relation_type in temporal_event:
-                    # Split on the relation
-                    parts = temporal_event.split(relation_type)
-                    if len(parts) == 2:
-                        # First part has subject (remove opening parenthesis)
-                        subject = parts[0].strip().replace('(', '').strip().lower().replace(' ', '_')
-                        
-                        # Second part has object and start/end info
-                        second_part = parts[1].strip()
-                        
-                        # Extract object (everything before ") starts/ends")
-                        if ') starts' in second_part:
-                            obj = second_part.split(') starts')[0].strip().lower().replace(' ', '_')
-                            start_or_end = 'starts'
-                            year = int(second_part.split('starts at ')[1])
-                        elif ') ends' in second_part:
-                            obj = second_part.split(') ends')[0].strip().lower().replace(' ', '_')
-                            start_or_end = 'ends'
-                            year = int(second_part.split('ends at ')[1])
-                        else:
-                            continue
-                        
-                        relation_token = relation_dict[relation_type]
-                        event_key = (subject, relation_token, obj)
-                        
-                        if start_or_end == 'starts':
-                            ongoing_events[event_key] = year
-                        elif start_or_end == 'ends':
-                            if event_key in ongoing_events:
-                                start_year = ongoing_events[event_key]
-                                facts += f'event({clean_term(subject)}, {clean_term(relation_token)}, {clean_term(obj)}, {start_year}, 1, {year}, 12).\n'
-                                del ongoing_events[event_key]
-                        
-                        break  # Found matching relation
+            parsed = parse_tgqa_event(temporal_event)
+            if parsed is None:
+                continue
+            subject, relation_token, obj, start_or_end, year = parsed
+            event_key = (subject, relation_token, obj)
+
+            if start_or_end == 'starts':
+                ongoing_events[event_key] = year
+            elif start_or_end == 'ends':
+                if event_key in ongoing_events:
+                    start_year = ongoing_events[event_key]
+                    facts.append(f'event({clean_term(subject)}, {clean_term(relation_token)}, {clean_term(obj)}, {start_year}, 1, {year}, 12).\n')
+                    del ongoing_events[event_key]
 
         # Handle events that only had starts (no explicit ends)
         for (subject, relation_token, obj), start_year in ongoing_events.items():
-            facts += f'event({clean_term(subject)}, {clean_term(relation_token)}, {clean_term(obj)}, {start_year}, 1, {start_year}, 1).\n'
+            facts.append(f'event({clean_term(subject)}, {clean_term(relation_token)}, {clean_term(obj)}, {start_year}, 1, {start_year}, 1).\n')
+        facts = ''.join(facts)
 
     elif TG_type == 'TimeQA':
-        facts = ''
+        if default_date is None:
+            default_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        facts = []
         for temporal_event in TG:
-            # extract time interval and event
-            interval, event = temporal_event.split(':')
-            # split to get start str and end string separately
-            if '-' in interval:
-                start_date, end_date = interval.split('-')
-            else:
-                start_date, end_date = interval, interval
-            # parse start and end strings into timestamp float
-            start_date = parser.parse(start_date.strip())
-            end_date = parser.parse(end_date.strip())
-            start_year, start_moth = int(f"{start_date.year}"), int(f"{start_date.month:02d}")
-            end_year, end_month = int(f"{end_date.year}"), int(f"{end_date.month:02d}")
-            
-            # extract entities (nodes) in temporal graph
-            poss_match = re.match(r"(.+?)'s\s+(.*?)\s+", event.strip())
-            
-            if poss_match:
-                out_node = poss_match.group(1).strip().lower().replace(' ', '_')
-                relation = poss_match.group(2).strip().lower().replace(' ', '_')
-                
-                # Find all objects in parentheses
-                in_nodes = re.findall(r'\(\s*([^)]+)\s*\)', event.strip())
-                in_nodes = [node.strip().lower().replace(' ', '_') for node in in_nodes]
-            
-            else:
-                # Assumes format like "Galatasaray S.K. (football) is ( Unknown )"
-                direct_match = re.match(r"(.+?)\s+(\w+)\s+", event.strip())
-                
-                if not direct_match:
-                    return None  # unrecognized format, skip or log it
-                
-                out_node = direct_match.group(1).strip().lower().replace(' ', '_')
-                relation = direct_match.group(2).strip().lower().replace(' ', '_')
-                
-                # Find all objects in parentheses
-                in_nodes = re.findall(r'\(\s*([^)]+)\s*\)', event.strip())
-                in_nodes = [node.strip().lower().replace(' ', '_') for node in in_nodes]
-            
-            for in_node in in_nodes:
-                facts += f'event({clean_term(out_node)}, {clean_term(relation)}, {clean_term(in_node)}, {start_year}, {start_moth}, {end_year}, {end_month}).\n'
+            event_facts = timeqa_event_facts(temporal_event, default_date)
+            if event_facts is None:
+                return None  # unrecognized format, skip or log it
+            facts.extend(event_facts)
+        facts = ''.join(facts)
     
     # my implementation does not support TempReason data.
     # The questions from the two other datasets alone are already way too many if we were to use all $30 for text complete
@@ -160,9 +232,26 @@ def tg_to_asp(TG, TG_type: str) -> str:
     
 
 
-def create_asp_instance_files(dataset, TG_type: str) -> None:
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def load_manifest(directory: str) -> dict:
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {'converter': None, 'instances': {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def create_asp_instance_files(dataset, TG_type: str, incremental: bool = False, workers: int = 1) -> None:
     """
     given a TGR dataset generate all samples corresponding instance files containing the corresp
+
+    Args:
+        incremental (bool) skip instances whose TG and converter are unchanged since the last run (see the
+            manifest in the output directory); converted instances are only written if their content changed
+        workers (int) number of processes converting TGs in parallel
     """
 
 
@@ -170,23 +259,124 @@ def create_asp_instance_files(dataset, TG_type: str) -> None:
     directory = f"ASPinstances/{TG_type}"
     os.makedirs(directory, exist_ok=True)
 
+    manifest = load_manifest(directory)
+    reuse = incremental and manifest['converter'] == CONVERTER_HASH
+    entries = {}
+
+    # find instances whose TG changed since the last run
+    todo = []
     for instance in dataset:
         # extract identifier of dataset example and construct corresponding asp instance file
         file_name = instance['id'].replace('/', '_') + '.lp'
-        facts = tg_to_asp(instance['TG'], TG_type)
-        # Write facts to file
+        input_hash = content_hash(json.dumps([TG_type, instance['TG']]))
+        entry = manifest['instances'].get(instance['id'])
+        if (reuse and entry and entry['file'] == file_name and entry['input_hash'] == input_hash
+                and os.path.exists(os.path.join(directory, file_name))):
+            entries[instance['id']] = entry
+        else:
+            todo.append((instance['id'], file_name, input_hash, instance['TG']))
+
+    TGs = [TG for _, _, _, TG in todo]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            converted = list(pool.map(tg_to_asp, TGs, [TG_type] * len(TGs), chunksize=64))
+    else:
+        converted = [tg_to_asp(TG, TG_type) for TG in TGs]
+
+    written = 0
+    for (instance_id, file_name, input_hash, _), facts in zip(todo, converted):
         file_path = os.path.join(directory, file_name)
-        with open(file_path, 'w') as f:
-            f.write(facts)
+        output_hash = content_hash(facts)
+        if incremental and os.path.exists(file_path):
+            with open(file_path) as f:
+                unchanged = content_hash(f.read()) == output_hash
+        else:
+            unchanged = False
+        # Write facts to file
+        if not unchanged:
+            write_atomic(file_path, facts)
+            written += 1
+        entries[instance_id] = {'file': file_name, 'input_hash': input_hash, 'output_hash': output_hash}
+
+    write_atomic(os.path.join(directory, MANIFEST_NAME),
+                 json.dumps({'converter': CONVERTER_HASH, 'instances': entries}, indent=2))
+    print(f'{TG_type}: {len(entries) - len(todo)} unchanged, {len(todo)} converted, {written} files written')
+
+def check_instance_files(dataset, TG_type: str, default_date: datetime = None) -> list:
+    """
+    regression check of tg_to_asp against the instance files in ASPinstances/{TG_type}
+
+    TimeQA dates given only as a year take their month from default_date, so pass the date the
+    files were generated on (INSTANCE_FILES_DATE for the bundled files) to compare TimeQA files
+
+    Return:
+        The ids whose converted TG differs from the existing instance file
+    """
+    directory = f"ASPinstances/{TG_type}"
+    mismatches = []
+    for instance in dataset:
+        file_path = os.path.join(directory, instance['id'].replace('/', '_') + '.lp')
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path) as f:
+            if f.read() != tg_to_asp(instance['TG'], TG_type, default_date):
+                mismatches.append(instance['id'])
+    print(f'{TG_type}: {len(mismatches)} instance files differ from tg_to_asp output')
+    return mismatches
+
+def stored_TGs(results_dir: str = 'results') -> dict:
+    """
+    the TGs stored in LLM result files (instance_TG), by the name of the story's instance file
+    """
+    TGs = {}
+    for fname in sorted(os.listdir(results_dir)):
+        if not fname.endswith('.json') or fname == 'asp_results.json':
+            continue
+        with open(os.path.join(results_dir, fname)) as f:
+            results = json.load(f)
+        for res in results.values():
+            if 'instance_TG' in res:
+                story_id = QUESTION_SUFFIX.sub('', res['instance_id'])
+                TGs[story_id.replace('/', '_') + '.lp'] = res['instance_TG']
+    return TGs
+
+
+def check_stored_instance_files(results_dir: str = 'results', default_date: datetime = INSTANCE_FILES_DATE) -> list:
+    """
+    offline regression check of tg_to_asp: rebuild the instance files of the stories whose TG is stored in
+    LLM result files (instance_TG) and compare them byte for byte with ASPinstances/
+
+    Return:
+        The instance files that differ from tg_to_asp output
+    """
+    TGs = stored_TGs(results_dir)
+    checked = 0
+    mismatches = []
+    for file_name, TG in sorted(TGs.items()):
+        for TG_type in ['TGQA', 'TimeQA']:
+            file_path = os.path.join(f'ASPinstances/{TG_type}', file_name)
+            if os.path.exists(file_path):
+                checked += 1
+                with open(file_path) as f:
+                    if f.read() != tg_to_asp(TG.split('\n'), TG_type, default_date):
+                        mismatches.append(file_path)
+    print(f'{checked} instance files rebuilt from stored TGs, {len(mismatches)} differ from tg_to_asp output')
+    return mismatches
 
 def reason(instance_path, encoding_path) -> str:
     pass
 
-# run file to create instance files
+# run file to create instance files (with --check: compare tg_to_asp against the bundled files instead)
 if __name__ == '__main__':
 
+    if '--check' in sys.argv[1:]:
+        mismatches = check_stored_instance_files()
+        for file_path in mismatches:
+            print(f'  {file_path}')
+        sys.exit(1 if mismatches else 0)
+
     # load TGLLM test sets of each dataset
-    datasets = {dataset: load_dataset("sxiong/TGQA", dataset)['test']
+    datasets = {dataset: load_split(dataset, 'test')[0]
             for dataset in ['TGQA_Story_TG_Trans', 'TimeQA_Story_TG_Trans', 'TempReason_Story_TG_Trans']
             }
     
@@ -0,0 +1,213 @@
+# span-style tracing of the LLM modules: wall time, tokens, retries and cache hits per stage
+# spans are appended to a JSONL trace; with tracing disabled (the default) every span is a shared no-op
+
+import sys
+import json
+import time
+import threading
+import contextvars
+from functools import wraps
+import numpy as np
+
+# span of the stage currently running in this thread or task, so code below the modules
+# (completion cache, retry loop) can attribute cache hits and retries to it
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class NullSpan:
+    """stands in for a span while tracing is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, key, value=1):
+        pass
+
+    def set(self, key, value):
+        pass
+
+    def record_usage(self, response):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    def __init__(self, tracer, name, instance_id):
+        self.tracer = tracer
+        self.name = name
+        self.instance_id = instance_id
+        self.attrs = {}
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        _current_span.reset(self._token)
+        record = {"span": self.name, "instance_id": self.instance_id, "start": self.start_time,
+                  "duration": duration, **self.attrs}
+        if exc is not None:
+            record["error"] = str(exc)
+        self.tracer.write(record)
+        return False
+
+    def add(self, key, value=1):
+        self.attrs[key] = self.attrs.get(key, 0) + value
+
+    def set(self, key, value):
+        self.attrs[key] = value
+
+    def record_usage(self, response):
+        """
+        add the token counts of a chat completion response; responses served from the completion cache
+        cost nothing, so their tokens go to cached_prompt_tokens and cached_completion_tokens instead
+        """
+        cached = getattr(response, "_from_cache", False)
+        if not cached:
+            self.add("calls")
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            prefix = "cached_" if cached else ""
+            self.add(prefix + "prompt_tokens", usage.prompt_tokens)
+            self.add(prefix + "completion_tokens", usage.completion_tokens)
+
+
+class Tracer:
+    """writes finished spans to a JSONL file while enabled; thread-safe"""
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def start(self, path, append=False):
+        self.path = path
+        self._file = open(path, "a" if append else "w")
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def span(self, name, instance_id=None):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, instance_id)
+
+    def write(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+                self._file.flush()
+
+
+tracer = Tracer()
+
+
+def current_span():
+    """span of the running stage, or NULL_SPAN outside of a traced stage"""
+    return _current_span.get() or NULL_SPAN
+
+
+async def in_span(span, coro):
+    """await coro with span as the current span (for work handed over to the event loop)"""
+    if span is NULL_SPAN:
+        return await coro
+    token = _current_span.set(span)
+    try:
+        return await coro
+    finally:
+        _current_span.reset(token)
+
+
+def traced_instance(fn):
+    """wrap a run_instance function in an "instance" span covering all its stages"""
+    @wraps(fn)
+    def wrapper(instance, *args, **kwargs):
+        if not tracer.enabled:
+            return fn(instance, *args, **kwargs)
+        with tracer.span("instance", instance["id"]):
+            return fn(instance, *args, **kwargs)
+
+    return wrapper
+
+
+def summarize_trace(path, verbose=True):
+    """
+    per-stage latency percentiles and token use of a trace, plus tokens per question and throughput
+
+    Return:
+        A dictionary with "stages" (per span name) and "instances" (per-question totals)
+    """
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    stages = {}
+    for record in records:
+        stages.setdefault(record["span"], []).append(record)
+
+    def total(group, key):
+        return int(sum(record.get(key, 0) for record in group))
+
+    summary = {"stages": {}}
+    for name, group in stages.items():
+        durations = [record["duration"] for record in group]
+        summary["stages"][name] = {
+            "count": len(group),
+            "p50": float(np.percentile(durations, 50)),
+            "p95": float(np.percentile(durations, 95)),
+            "total_seconds": float(sum(durations)),
+            "calls": total(group, "calls"),
+            "prompt_tokens": total(group, "prompt_tokens"),
+            "completion_tokens": total(group, "completion_tokens"),
+            "cached_prompt_tokens": total(group, "cached_prompt_tokens"),
+            "cached_completion_tokens": total(group, "cached_completion_tokens"),
+            "cache_hits": total(group, "cache_hits"),
+            "retries": total(group, "retries"),
+            "errors": sum(1 for record in group if "error" in record),
+        }
+
+    instances = stages.get("instance", [])
+    if instances:
+        stage_records = [record for record in records if record["span"] != "instance"]
+        n = len(instances)
+        first = min(record["start"] for record in instances)
+        last = max(record["start"] + record["duration"] for record in instances)
+        summary["instances"] = {
+            "count": n,
+            "prompt_tokens_per_question": total(stage_records, "prompt_tokens") / n,
+            "completion_tokens_per_question": total(stage_records, "completion_tokens") / n,
+            "cached_tokens_per_question": (total(stage_records, "cached_prompt_tokens")
+                                           + total(stage_records, "cached_completion_tokens")) / n,
+            "throughput": n / (last - first) if last > first else None,
+        }
+
+    if verbose:
+        print(f"{'span':15} {'count':>6} {'p50 (s)':>9} {'p95 (s)':>9} {'prompt tok':>11} {'compl. tok':>11}"
+              f" {'cache hits':>10} {'retries':>8}")
+        for name, stats in summary["stages"].items():
+            print(f"{name:15} {stats['count']:6} {stats['p50']:9.3f} {stats['p95']:9.3f} {stats['prompt_tokens']:11}"
+                  f" {stats['completion_tokens']:11} {stats['cache_hits']:10} {stats['retries']:8}")
+        if "instances" in summary:
+            stats = summary["instances"]
+            throughput = f"{stats['throughput']:.2f} questions/s" if stats["throughput"] else "n/a"
+            print(f"Tokens per question: {stats['prompt_tokens_per_question']:.0f} prompt, "
+                  f"{stats['completion_tokens_per_question']:.0f} completion "
+                  f"(plus {stats['cached_tokens_per_question']:.0f} served from cache); throughput {throughput}")
+    return summary
+
+
+if __name__ == "__main__":
+    summarize_trace(sys.argv[1])
@@ -0,0 +1,18 @@
+# small helpers shared by the modules, using only the standard library,
+# so that importing one of them does not pull in a module's dependencies (dateutil, pandas, datasets, clingo)
+
+import os
+
+# month names and abbreviations of TimeQA dates, lowercased, to month numbers
+MONTHS = {name: month for month, names in enumerate([
+    ('jan', 'january'), ('feb', 'february'), ('mar', 'march'), ('apr', 'april'), ('may',), ('jun', 'june'),
+    ('jul', 'july'), ('aug', 'august'), ('sep', 'sept', 'september'), ('oct', 'october'), ('nov', 'november'),
+    ('dec', 'december')], start=1) for name in names}
+
+
+def write_atomic(file_path: str, content: str) -> None:
+    """write to a temporary file next to file_path and move it into place, so readers never see partial files"""
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, file_path)
@@ -0,0 +1,160 @@
+# native NumPy implementation of the rules in tg_reasoner.lp
+# derives the same atoms clingo would show for an instance file, grouped by predicate name,
+# without spawning a solver process or grounding the encoding
+
+import re
+import numpy as np
+
+# event(S, R, O, SY, SM, EY, EM) facts as written by symbolic_module.tg_to_asp
+EVENT_PATTERN = re.compile(
+    r"event\(\s*([^,()\s]+)\s*,\s*([^,()\s]+)\s*,\s*([^,()\s]+)\s*,"
+    r"\s*(-?\d+)\s*,\s*(-?\d+)\s*,\s*(-?\d+)\s*,\s*(-?\d+)\s*\)\s*\."
+)
+
+# number of rows compared against all other rows at once when building pairwise relations
+BLOCK_SIZE = 2048
+
+
+def parse_events(text: str):
+    """
+    extract all event/7 facts from the content of an ASP instance file
+
+    Args:
+        text (str) content of an instance file
+
+    Return:
+        sro (list) "S,R,O" string of every distinct event, indexed by event id
+        facts (np.ndarray) int64 array of shape (n, 5) with columns event id, SY, SM, EY, EM
+    """
+    ids = {}
+    rows = []
+    for s, r, o, sy, sm, ey, em in EVENT_PATTERN.findall(text):
+        key = f"{s},{r},{o}"
+        eid = ids.setdefault(key, len(ids))
+        rows.append((eid, int(sy), int(sm), int(ey), int(em)))
+
+    facts = np.array(rows, dtype=np.int64).reshape(-1, 5)
+    return list(ids), facts
+
+
+def _clingo_divmod(L):
+    # clingo's "/" truncates towards zero and "\" keeps the sign of the dividend
+    Y = np.sign(L) * (np.abs(L) // 12)
+    return Y, L - 12 * Y
+
+
+def _join_on_event(left_ids, right_ids):
+    """indices (i, j) of all row pairs with left_ids[i] == right_ids[j]; right_ids must be sorted"""
+    lo = np.searchsorted(right_ids, left_ids, side="left")
+    counts = np.searchsorted(right_ids, left_ids, side="right") - lo
+    i = np.repeat(np.arange(len(left_ids)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return i, np.repeat(lo, counts) + offsets
+
+
+def _pairs(n_left, condition, block_size=BLOCK_SIZE):
+    """
+    indices (i, j) of all row pairs for which condition holds
+
+    condition receives a slice over the left rows and returns a boolean matrix against all right rows,
+    so memory for the comparison stays bounded by block_size times the number of right rows
+    """
+    lefts, rights = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    for lo in range(0, n_left, block_size):
+        i, j = np.nonzero(condition(slice(lo, lo + block_size)))
+        lefts.append(i + lo)
+        rights.append(j)
+    return np.concatenate(lefts), np.concatenate(rights)
+
+
+def _unique_rows(*columns):
+    """stack columns and drop duplicate rows (answer sets contain every atom once)"""
+    rows = np.stack(columns, axis=1) if columns[0].size else np.empty((0, len(columns)), dtype=np.int64)
+    return np.unique(rows, axis=0)
+
+
+def derive_atoms(sro: list, facts: np.ndarray) -> dict:
+    """
+    compute all atoms of tg_reasoner.lp for the given events
+
+    Args:
+        sro (list) "S,R,O" string per event id, as returned by parse_events
+        facts (np.ndarray) event facts as returned by parse_events
+
+    Return:
+        A dictionary mapping each predicate name to its atoms in clingo's textual form,
+        in the same shape as the per-instance entries of asp_results.json
+    """
+    terms = [f"event({e})" for e in sro]
+
+    events = _unique_rows(*facts.T)
+    eid, SY, SM, EY, EM = events.T
+
+    # start/4 and end/4 (temporal index in months counting from year 0)
+    starts = _unique_rows(eid, SY * 12 + (SM - 1))
+    ends = _unique_rows(eid, EY * 12 + (EM - 1))
+    s_id, s_T = starts.T
+    e_id, e_T = ends.T
+
+    # ordering_on_start_years/2: number of start atoms strictly before, plus one
+    idx = np.searchsorted(np.sort(s_T), s_T, side="left") + 1
+    ordering = _unique_rows(s_id, idx)
+
+    # every start/end combination of the same event (the body of length/3 and was_still_happening/2)
+    i, j = _join_on_event(s_id, e_id)
+    iv_id, iv_T, iv_E = s_id[i], s_T[i], e_T[j]
+
+    # length/3
+    lengths = _unique_rows(iv_id, iv_E - iv_T)
+    l_id, l_L = lengths.T
+
+    # longer_than/2
+    i, j = _pairs(len(l_L), lambda sl: l_L[sl, None] > l_L[None, :])
+    longer = _unique_rows(l_id[i], l_id[j])
+
+    # time_passed/4
+    i, j = _pairs(len(s_T), lambda sl: (s_id[sl, None] != s_id[None, :]) & (s_T[sl, None] >= s_T[None, :]))
+    passed = _unique_rows(s_id[i], s_id[j], s_T[i] - s_T[j])
+
+    # starts_at/2
+    starts_at = _unique_rows(eid, SY)
+    a_id, a_Y = starts_at.T
+
+    # started_same_year/2 (includes every event paired with itself)
+    i, j = _pairs(len(a_Y), lambda sl: a_Y[sl, None] == a_Y[None, :])
+    same_year = _unique_rows(a_id[i], a_id[j])
+
+    # was_still_happening/2
+    i, j = _pairs(len(iv_T), lambda sl: (iv_id[sl, None] != s_id[None, :])
+                  & (iv_T[sl, None] <= s_T[None, :])
+                  & (s_T[None, :] <= iv_E[sl, None]))
+    still = _unique_rows(iv_id[i], s_id[j])
+
+    length_Y, length_M = _clingo_divmod(l_L)
+    passed_Y, passed_M = _clingo_divmod(passed[:, 2])
+
+    atoms = {
+        "event": [f"event({sro[e]},{sy},{sm},{ey},{em})" for e, sy, sm, ey, em in events.tolist()],
+        "start": [f"start({sro[e]},{t})" for e, t in starts.tolist()],
+        "end": [f"end({sro[e]},{t})" for e, t in ends.tolist()],
+        "ordering_on_start_years": [f"ordering_on_start_years({terms[e]},{k})" for e, k in ordering.tolist()],
+        "length": [f"length({terms[e]},{y},{m})"
+                   for e, y, m in zip(l_id.tolist(), length_Y.tolist(), length_M.tolist())],
+        "longer_than": [f"longer_than({terms[a]},{terms[b]})" for a, b in longer.tolist()],
+        "time_passed": [f"time_passed({terms[a]},{terms[b]},{y},{m})"
+                        for a, b, y, m in zip(passed[:, 0].tolist(), passed[:, 1].tolist(),
+                                              passed_Y.tolist(), passed_M.tolist())],
+        "starts_at": [f"starts_at({terms[e]},{y})" for e, y in starts_at.tolist()],
+        "started_same_year": [f"started_same_year({terms[a]},{terms[b]})" for a, b in same_year.tolist()],
+        "was_still_happening": [f"was_still_happening({terms[a]},{terms[b]})" for a, b in still.tolist()],
+    }
+
+    # clingo only reports predicates that have at least one atom in the answer set
+    return {pred: values for pred, values in atoms.items() if values}
+
+
+def solve_file(fpath: str) -> dict:
+    """derive all atoms of tg_reasoner.lp for the instance file at fpath"""
+    with open(fpath) as f:
+        sro, facts = parse_events(f.read())
+    return derive_atoms(sro, facts)
@@ -0,0 +1,14 @@
+# the modules import each other by name from src/ and open their data (encodings, prompts, ASPinstances,
+# results) relative to the repository root, as when they are run from there
+
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+
+@pytest.fixture(autouse=True)
+def repository_root(monkeypatch):
+    monkeypatch.chdir(ROOT)
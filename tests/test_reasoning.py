@@ -0,0 +1,65 @@
+# regression tests of the symbolic side on a small fixed subset of ASPinstances/:
+# the converter still produces the stored instance files, and the encodings and solver backends agree on them
+
+import os
+import shutil
+import pytest
+
+from symbolic_module import tg_to_asp, stored_TGs, INSTANCE_FILES_DATE
+from entailment import check_parity, check_encoding_agreement, solve_instance, ENCODINGS, AGREEMENT_CONSTS
+
+# small, medium and large stories of each dataset whose TGs are stored in results/
+INSTANCES = {
+    "TGQA": ["story503.lp", "story511.lp", "story540.lp"],
+    "TimeQA": ["_wiki_Game_Grumps#P371.lp", "_wiki_Lotte_Reiniger#P551.lp", "_wiki_George_Ritchie_(politician)#P39.lp"],
+}
+SUBSET = [(TG_type, fname) for TG_type, fnames in INSTANCES.items() for fname in fnames]
+
+requires_clingo = pytest.mark.skipif(shutil.which("clingo") is None, reason="needs the clingo executable")
+
+
+@pytest.fixture(scope="module")
+def TGs():
+    return stored_TGs()
+
+
+@pytest.fixture
+def instance_dirs(tmp_path):
+    """copies of the subset's instance files, laid out like ASPinstances/"""
+    dirs = []
+    for TG_type, fnames in INSTANCES.items():
+        directory = tmp_path / TG_type
+        directory.mkdir()
+        for fname in fnames:
+            shutil.copy(os.path.join("ASPinstances", TG_type, fname), directory)
+        dirs.append(str(directory))
+    return dirs
+
+
+@pytest.mark.parametrize("TG_type,fname", SUBSET)
+def test_converter_reproduces_instance_file(TGs, TG_type, fname):
+    with open(os.path.join("ASPinstances", TG_type, fname)) as f:
+        expected = f.read()
+    assert tg_to_asp(TGs[fname].split("\n"), TG_type, INSTANCE_FILES_DATE) == expected
+
+
+@pytest.mark.parametrize("consts", AGREEMENT_CONSTS,
+                         ids=lambda consts: f"{consts['pair_window']}-{consts['pair_scope']}")
+def test_scalable_encoding_agrees_with_original(instance_dirs, consts):
+    assert check_encoding_agreement("clingo", instance_dirs, "scalable", consts) == {}
+
+
+@pytest.mark.parametrize("TG_type,fname", SUBSET)
+def test_numpy_backend_agrees_with_clingo_api(TG_type, fname):
+    fpath = os.path.join("ASPinstances", TG_type, fname)
+    expected = solve_instance("clingo", ENCODINGS["original"], fpath, 30, "clingo_api")
+    actual = solve_instance("clingo", ENCODINGS["original"], fpath, 30, "numpy")
+    assert expected
+    assert {pred: set(atoms) for pred, atoms in actual.items()} == \
+           {pred: set(atoms) for pred, atoms in expected.items()}
+
+
+@requires_clingo
+@pytest.mark.parametrize("backend", ["numpy", "clingo_api"])
+def test_backends_agree_with_clingo(instance_dirs, backend):
+    assert check_parity("clingo", "original", instance_dirs, backend=backend) == {}